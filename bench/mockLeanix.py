@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ Purpose :
+   Benchmark the converter without a LeanIX tenant
+   - Local LeanIX stand-in : the subset of the APIs read by connectorAPI
+       POST /services/mtm/v1/oauth2/token
+       POST /services/pathfinder/v1/graphql         allFactSheets, with cursors
+       GET  /services/pathfinder/v1/factSheets      paginated by type
+       GET  /services/pathfinder/v1/factSheets/{id}
+       POST /ntfy/{channel}                         ntfy stand-in
+       GET  /_stats                                 requests and bytes by kind
+'''
+
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from workspaceGenerator import WorkspaceGenerator
+
+__author__ = "Serge LASSABE"
+__copyright__ = "Copyright (C) 2023, Serge LASSABE"
+__license__ = "agpl-3.0"
+__version__ = "5.0.1"
+
+TYPE_KEYS = re.compile(r'keys: \["(\w+)"\]|factSheetType: (\w+)')
+RELATIONS = re.compile(r'\b(rel\w+)\s*\{')
+FIRST = re.compile(r'first: (\d+)')
+REST_FACT_SHEET = re.compile(r'.*/factSheets/([^/?]+)$')
+
+
+class MockLeanix():
+    """ Serve a workspace built by WorkspaceGenerator
+
+    Args:
+        latency (float): seconds added to each response (network and LeanIX time)
+    """
+
+    def __init__(self, workspace, latency=0.0):
+        self.fact_sheets = workspace['factSheets']
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.stats = {}     # {kind: {'requests': n, 'bytes': n}}
+        self.selections = {}    # {query and filters: fact sheets}, the workspace does not change
+        self.server = None
+        self.thread = None
+
+    def count(self, kind, size):
+        with self.lock:
+            stats = self.stats.setdefault(kind, {'requests': 0, 'bytes': 0})
+            stats['requests'] += 1
+            stats['bytes'] += size
+
+    ## GraphQL
+    def select(self, query, variables):
+        # Pages of a query share its selection
+        key = (query, json.dumps({k: v for k, v in variables.items() if k not in ('first', 'cursor')},
+                                 sort_keys=True))
+        selection = self.selections.get(key)
+        if selection is None:
+            selection = self.selections[key] = self.filter(query, variables)
+        return selection
+
+    def filter(self, query, variables):
+        types = variables.get('types') or ([variables['atype']] if variables.get('atype') else None)
+        if not types:
+            match = TYPE_KEYS.search(query)
+            types = [match.group(1) or match.group(2)] if match else None
+        archived = 'TrashBin' in query
+        selection = [fs for fs in self.fact_sheets.values()
+                     if (not types or fs['type'] in types) and (fs['status'] == 'ARCHIVED') == archived]
+        if variables.get('ids'):
+            ids = set(variables['ids'])
+            selection = [fs for fs in selection if fs['id'] in ids]
+        if '"updatedAt", order: desc' in query:
+            selection.sort(key=lambda fs: fs['updatedAt'], reverse=True)
+        return selection
+
+    def node(self, fact_sheet, relations):
+        node = {key: fact_sheet[key] for key in ('id', 'type', 'name', 'displayName',
+                                                 'description', 'status', 'updatedAt')}
+        for relation in relations:
+            edges = []
+            for rel_id, target_id in fact_sheet['rels'].get(relation, ()):
+                target = self.fact_sheets[target_id]
+                if target['status'] != 'ACTIVE':
+                    continue
+                edges.append({'node': {'id': rel_id, 'type': relation,
+                                       'factSheet': {key: target[key] for key in
+                                                     ('id', 'name', 'displayName', 'type')}}})
+            node[relation] = {'edges': edges}
+        return node
+
+    def graphql(self, body):
+        query = body['query']
+        variables = body.get('variables') or {}
+        selection = self.select(query, variables)
+        first = variables.get('first')
+        match = FIRST.search(query)
+        if match:
+            first = int(match.group(1))
+        first = first or len(selection) or 1
+        cursor = int(variables.get('cursor') or 0)
+        relations = set(RELATIONS.findall(query))
+        return {'data': {'allFactSheets': {
+            'totalCount': len(selection),
+            'pageInfo': {'hasNextPage': cursor + first < len(selection),
+                         'endCursor': str(cursor + first)},
+            'edges': [{'node': self.node(fs, relations)}
+                      for fs in selection[cursor:cursor + first]]}}}
+
+    ## REST
+    def entry(self, fact_sheet):
+        return {key: fact_sheet[key] for key in ('id', 'type', 'displayName', 'tags', 'fields')}
+
+    def rest(self, path, parameters):
+        match = REST_FACT_SHEET.match(path)
+        if match:
+            fact_sheet = self.fact_sheets.get(match.group(1))
+            return fact_sheet and {'status': 'OK', 'data': self.entry(fact_sheet)}
+        type = parameters['type'][0]
+        size = int(parameters['pageSize'][0])
+        cursor = int(parameters.get('cursor', ['0'])[0])
+        selection = self.selections.get(type)
+        if selection is None:
+            selection = self.selections[type] = [fs for fs in self.fact_sheets.values()
+                                                 if fs['type'] == type and fs['status'] == 'ACTIVE']
+        return {'status': 'OK', 'data': [self.entry(fs) for fs in selection[cursor:cursor + size]],
+                'cursor': str(cursor + size), 'total': len(selection)}
+
+    def serve(self, host='127.0.0.1', port=0):
+        ''' Start serving in background, return the base URL '''
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'   # Keep-alive, as LeanIX
+
+            def reply(self, kind, body):
+                data = json.dumps(body).encode('utf-8')
+                if mock.latency:
+                    time.sleep(mock.latency)
+                mock.count(kind, len(data))
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.path.endswith('/oauth2/token'):
+                    return self.reply('oauth', {'access_token': 'mock-token', 'expires_in': 3600})
+                if self.path.endswith('/graphql'):
+                    return self.reply('graphql', mock.graphql(json.loads(body)))
+                if self.path.startswith('/ntfy/'):
+                    return self.reply('ntfy', {})
+                self.send_error(404)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == '/_stats':
+                    return self.reply('stats', mock.stats)
+                body = mock.rest(url.path, parse_qs(url.query)) if '/factSheets' in url.path else None
+                if body:
+                    return self.reply('rest', body)
+                self.send_error(404)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return f'http://{host}:{self.server.server_port}'
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def serve_in_process(generator_args, latency, connection):
+    ''' Target of a child process : the benchmark does not measure the mock '''
+    mock = MockLeanix(WorkspaceGenerator(**generator_args).generate(), latency)
+    connection.send(mock.serve())
+    connection.recv()   # Until the benchmark is over
+    mock.shutdown()
+
+
+def add_generator_arguments(parser):
+    parser.add_argument('--apps', type=int, default=500, help='number of applications')
+    parser.add_argument('--interfaces-per-app', type=float, default=1.5, help='interfaces per application')
+    parser.add_argument('--max-consumers', type=int, default=3, help='consumers of an interface')
+    parser.add_argument('--data-objects', type=int, default=50, help='number of data objects')
+    parser.add_argument('--tags', type=int, default=2, help='tags per application and interface')
+    parser.add_argument('--phases', type=int, default=2, help='lifecycle phases per application and interface')
+    parser.add_argument('--projects', type=int, default=0, help='number of projects (full extraction)')
+    parser.add_argument('--it-components', type=int, default=0, help='number of IT components (full extraction)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='added to each response')
+
+
+def generator_arguments(args):
+    return {'apps': args.apps, 'interfaces_per_app': args.interfaces_per_app,
+            'max_consumers': args.max_consumers, 'data_objects': args.data_objects,
+            'tags_per_fact_sheet': args.tags, 'lifecycle_phases': args.phases,
+            'projects': args.projects, 'it_components': args.it_components, 'seed': args.seed}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a synthetic LeanIX workspace')
+    add_generator_arguments(parser)
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args()
+    mock = MockLeanix(WorkspaceGenerator(**generator_arguments(args)).generate(),
+                      args.latency_ms / 1000)
+    print(f'LEANIX_URL={mock.serve(port=args.port)}')
+    try:
+        mock.thread.join()
+    except KeyboardInterrupt:
+        mock.shutdown()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ Purpose :
+   Benchmark the converter without a LeanIX tenant
+   - Local SFTP stand-in : serves a directory (paramiko server), any password
+     is accepted, with the posix-rename@openssh.com extension
+'''
+
+import argparse
+import os
+import socket
+import threading
+
+import paramiko
+from paramiko.sftp import SFTP_OK
+
+__author__ = "Serge LASSABE"
+__copyright__ = "Copyright (C) 2023, Serge LASSABE"
+__license__ = "agpl-3.0"
+__version__ = "5.0.1"
+
+
+class Server(paramiko.ServerInterface):
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+
+class Handle(paramiko.SFTPHandle):
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as exc:
+            return paramiko.SFTPServer.convert_errno(exc.errno)
+
+
+class DirectorySFTP(paramiko.SFTPServerInterface):
+    ''' The served directory is the root of the SFTP server '''
+    root = None
+
+    def path(self, path):
+        return os.path.join(self.root, self.canonicalize(path).lstrip('/'))
+
+    def list_folder(self, path):
+        try:
+            path = self.path(path)
+            return [paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(path, name)), name)
+                    for name in os.listdir(path)]
+        except OSError as exc:
+            return paramiko.SFTPServer.convert_errno(exc.errno)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self.path(path)))
+        except OSError as exc:
+            return paramiko.SFTPServer.convert_errno(exc.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        try:
+            fd = os.open(self.path(path), flags | getattr(os, 'O_BINARY', 0), 0o644)
+        except OSError as exc:
+            return paramiko.SFTPServer.convert_errno(exc.errno)
+        if flags & os.O_WRONLY:
+            mode = 'ab' if flags & os.O_APPEND else 'wb'
+        elif flags & os.O_RDWR:
+            mode = 'a+b' if flags & os.O_APPEND else 'r+b'
+        else:
+            mode = 'rb'
+        handle = Handle(flags)
+        handle.filename = self.path(path)
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        return handle
+
+    def remove(self, path):
+        try:
+            os.remove(self.path(path))
+        except OSError as exc:
+            return paramiko.SFTPServer.convert_errno(exc.errno)
+        return SFTP_OK
+
+    def rename(self, oldpath, newpath):
+        # SFTP rename does not overwrite
+        if os.path.exists(self.path(newpath)):
+            return paramiko.SFTPServer.convert_errno(17)
+        return self.posix_rename(oldpath, newpath)
+
+    def posix_rename(self, oldpath, newpath):
+        try:
+            os.replace(self.path(oldpath), self.path(newpath))
+        except OSError as exc:
+            return paramiko.SFTPServer.convert_errno(exc.errno)
+        return SFTP_OK
+
+
+class MockSftp():
+    """ Serve directory over SFTP, one thread per connection """
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.socket = None
+        self.thread = None
+
+    def handle(self, connection):
+        sftp_class = type('RootedSFTP', (DirectorySFTP,), {'root': self.directory})
+        transport = paramiko.Transport(connection)
+        transport.add_server_key(self.host_key)
+        transport.set_subsystem_handler('sftp', paramiko.SFTPServer, sftp_class)
+        transport.start_server(server=Server())
+
+    def accept(self):
+        while True:
+            try:
+                connection, _ = self.socket.accept()
+            except OSError:     # Closed by shutdown
+                return
+            threading.Thread(target=self.handle, args=(connection,), daemon=True).start()
+
+    def serve(self, host='127.0.0.1', port=0):
+        ''' Start serving in background, return host:port (SFTP_SRV) '''
+        self.socket = socket.create_server((host, port))
+        self.thread = threading.Thread(target=self.accept, daemon=True)
+        self.thread.start()
+        return f'{host}:{self.socket.getsockname()[1]}'
+
+    def shutdown(self):
+        self.socket.close()
+
+
+def serve_in_process(directory, connection):
+    ''' Target of a child process : the benchmark does not measure the server '''
+    mock = MockSftp(directory)
+    connection.send(mock.serve())
+    connection.recv()   # Until the benchmark is over
+    mock.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a directory over SFTP')
+    parser.add_argument('directory')
+    parser.add_argument('--port', type=int, default=2222)
+    args = parser.parse_args()
+    mock = MockSftp(args.directory)
+    print(f'SFTP_SRV={mock.serve(port=args.port)}')
+    try:
+        mock.thread.join()
+    except KeyboardInterrupt:
+        mock.shutdown()
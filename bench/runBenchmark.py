@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ Purpose :
+   Benchmark the converter without a LeanIX tenant
+   - Run launch_it end to end against the local LeanIX stand-in (run in a child
+     process, so it is not measured) and report wall time, LeanIX requests,
+     peak RSS and the time of each stage
+   - Each run has its own process : ru_maxrss never decreases, the peak RSS of
+     a run is not the one of the runs before it
+   - With --workspaces, several workspaces converted at once (launch_batch)
+'''
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import requests
+
+from mockLeanix import serve_in_process, add_generator_arguments, generator_arguments
+import mockSftp
+
+# The converter modules are at the root of the repository
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import leanIxConverter
+from leanIXConverterModels import Model
+from connectorAPI import GraphQLReader
+from connectorArchi import XmlArchiWriter
+from connectorExcel import ExcelWriter
+from connectorColumnar import ColumnarWriter
+from sftpPublisher import SftpPublisher
+from httpTransport import get_default_transport
+from customLog import init_log
+
+__author__ = "Serge LASSABE"
+__copyright__ = "Copyright (C) 2023, Serge LASSABE"
+__license__ = "agpl-3.0"
+__version__ = "5.0.1"
+
+# Stage name -> (owner, function name) : timed while the benchmark runs
+STAGES = {'extraction':      (leanIxConverter, 'extract_model'),
+          'populate':        (GraphQLReader, 'populate'),
+          'flow names':      (Model, 'validate_flows'),
+          'snapshot':        (leanIxConverter, 'save_model'),
+          'checksum':        (leanIxConverter, 'check_if_changed'),
+          'oef':             (XmlArchiWriter, 'dump'),
+          'excel':           (ExcelWriter, 'dump'),
+          'warnings':        (Model, 'dump_warning'),
+          'columnar':        (ColumnarWriter, 'dump'),
+          'last conversion': (leanIxConverter, 'write_last_conversion'),
+          'upload':          (SftpPublisher, 'publish'),
+          'notify':          (leanIxConverter, 'inform')}
+
+
+class StageTimer():
+    ''' Wrap the stage functions to sum their elapsed time '''
+
+    def __init__(self, stages):
+        self.stages = stages
+        self.originals = {}
+        self.timings = {}   # {stage: {'calls': n, 'seconds': s}}
+
+    def wrap(self, stage, function):
+        timings = self.timings
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                timing = timings.setdefault(stage, {'calls': 0, 'seconds': 0.0})
+                timing['calls'] += 1
+                timing['seconds'] += time.perf_counter() - start
+        return timed
+
+    def __enter__(self):
+        for stage, (owner, name) in self.stages.items():
+            function = getattr(owner, name)
+            self.originals[stage] = function
+            setattr(owner, name, self.wrap(stage, function))
+        return self
+
+    def __exit__(self, *exc):
+        for stage, (owner, name) in self.stages.items():
+            setattr(owner, name, self.originals[stage])
+
+
+def request_stats(base):
+    return requests.get(f'{base}/_stats').json()
+
+
+def stats_delta(before, after):
+    return {kind: {key: value - before.get(kind, {}).get(key, 0) for key, value in stats.items()}
+            for kind, stats in after.items() if kind != 'stats'}
+
+
+def run(base, sftp_srv, workdir, args):
+    ''' One conversion in a fresh working directory '''
+    workdir.mkdir(parents=True)
+    (workdir / 'output').mkdir()
+    (workdir / 'log').mkdir()
+    os.chdir(workdir)
+    before = request_stats(base)
+    with StageTimer(STAGES) as timer:
+        start = time.perf_counter()
+        options = dict(columnar=args.columnar, ntfy_url=f'{base}/ntfy/', profile=args.profile,
+                       compression=args.compress, compact_oef=args.compact_oef)
+        if args.workspaces > 1:
+            # Batch mode : the writers run in other processes, their stages are not timed here
+            leanIxConverter.launch_batch([f'{args.workspace}{number}' for number in range(1, args.workspaces + 1)],
+                                         base, ['bench-token'], sftp_srv, 'bench', 'bench', 'bench', **options)
+        else:
+            leanIxConverter.launch_it(args.workspace, base, 'bench-token', sftp_srv, 'bench', 'bench', 'bench',
+                                      **options)
+        wall = time.perf_counter() - start
+    return {'wall_seconds': round(wall, 3),
+            'requests': stats_delta(before, request_stats(base)),
+            # Linux : kilobytes, the mock runs in another process
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'stages': {stage: {'calls': timer.timings[stage]['calls'],
+                               'seconds': round(timer.timings[stage]['seconds'], 3)}
+                       for stage in STAGES if stage in timer.timings}}
+
+
+def run_in_process(base, sftp_srv, workdir, args, connection):
+    # Child process of one run : its ru_maxrss is the peak RSS of this run only
+    leanIxConverter.logger = init_log('converter', 'bench.log')
+    leanIxConverter.logger.setLevel(args.log_level)
+    get_default_transport().set_host_budget(args.host_concurrency)
+    connection.send(run(base, sftp_srv, workdir, args))
+
+
+def measured_run(context, base, sftp_srv, workdir, args):
+    connection, child_connection = context.Pipe()
+    process = context.Process(target=run_in_process, args=(base, sftp_srv, workdir, args, child_connection))
+    process.start()
+    child_connection.close()     # recv fails instead of waiting forever when the run dies
+    try:
+        result = connection.recv()
+    except EOFError:
+        result = None
+    process.join()
+    if result is None:
+        raise RuntimeError(f'{workdir.name} failed (exit code {process.exitcode}), see the traceback above')
+    return result
+
+
+def print_report(report):
+    for number, result in enumerate(report['runs'], 1):
+        requests_count = sum(stats['requests'] for stats in result['requests'].values())
+        requests_bytes = sum(stats['bytes'] for stats in result['requests'].values())
+        print(f"run {number} : {result['wall_seconds']:.2f}s - {requests_count} requests "
+              f"({requests_bytes / 1e6:.1f} MB) - peak RSS {result['peak_rss_mb']} MB")
+        for stage, timing in result['stages'].items():
+            print(f"    {stage:<16} {timing['seconds']:>9.3f}s  x{timing['calls']}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Run the converter end to end against a synthetic LeanIX workspace')
+    add_generator_arguments(parser)
+    parser.add_argument('--runs', type=int, default=1, help='number of conversions')
+    parser.add_argument('--columnar', choices=['parquet', 'csv', 'jsonl'], help='also export in columnar format')
+    parser.add_argument('--workspace', default='bench', help='workspace name, used in the file names')
+    parser.add_argument('--workspaces', type=int, default=1,
+                        help='convert this many workspaces at once (batch mode), all served by the stand-in')
+    parser.add_argument('--host-concurrency', type=int, default=8, help='LeanIX requests in flight at once, 0 : no limit')
+    parser.add_argument('--workdir', type=Path, help='where the runs write their output/ and log/ (temporary directory by default)')
+    parser.add_argument('--report', type=Path, help='JSON report file (bench-report.json in the work directory by default)')
+    parser.add_argument('--compress', choices=['gzip', 'zstd', 'zip'], help='compress the OEF and Excel files')
+    parser.add_argument('--compact-oef', action='store_true', help='OEF files without indentation')
+    parser.add_argument('--sftp', action='store_true', help='also upload the files to a local SFTP stand-in')
+    parser.add_argument('--profile', action='store_true', help='profile each stage, in the log/ of each run')
+    parser.add_argument('--log-level', default='WARNING', help='converter log level')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    workdir = (args.workdir or Path(tempfile.mkdtemp(prefix='leanix-bench-'))).resolve()
+    report_file = (args.report or workdir / 'bench-report.json').resolve()
+    (Path(__file__).resolve().parent.parent / 'log').mkdir(exist_ok=True)
+
+    context = multiprocessing.get_context('spawn')
+    connection, child_connection = context.Pipe()
+    mock = context.Process(target=serve_in_process,
+                           args=(generator_arguments(args), args.latency_ms / 1000, child_connection),
+                           daemon=True)
+    mock.start()
+    base = connection.recv()
+    sftp_srv = ''
+    if args.sftp:
+        # The runs upload to the same directory : unchanged files are skipped
+        (workdir / 'sftp').mkdir(parents=True, exist_ok=True)
+        sftp_connection, child_connection = context.Pipe()
+        sftp = context.Process(target=mockSftp.serve_in_process,
+                               args=(str(workdir / 'sftp'), child_connection), daemon=True)
+        sftp.start()
+        sftp_srv = sftp_connection.recv()
+    try:
+        report = {'workspace': generator_arguments(args), 'latency_ms': args.latency_ms,
+                  'runs': [measured_run(context, base, sftp_srv, workdir / f'run-{number}', args)
+                           for number in range(1, args.runs + 1)]}
+    finally:
+        connection.send('stop')
+        mock.join(10)
+        if args.sftp:
+            sftp_connection.send('stop')
+            sftp.join(10)
+    with open(report_file, 'w') as output:
+        json.dump(report, output, indent=2)
+    print_report(report)
+    print(f'report : {report_file}')
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ Purpose :
+   Benchmark the converter without a LeanIX tenant
+   - Generate a synthetic workspace : applications, interfaces, data objects,
+     tags, lifecycle fields, parent/child and full extraction relations
+'''
+
+import random
+import uuid
+
+__author__ = "Serge LASSABE"
+__copyright__ = "Copyright (C) 2023, Serge LASSABE"
+__license__ = "agpl-3.0"
+__version__ = "5.0.1"
+
+TAG_GROUPS = ['Domain', 'Criticality', 'Hosting', 'Protocol', 'Owner', 'Cost center']
+PHASES = ['plan', 'phaseIn', 'active', 'phaseOut', 'endOfLife']
+UPDATED_AT = '2023-01-01T00:00:00.000Z'
+
+
+class WorkspaceGenerator():
+    """ Build a workspace : {'factSheets': {id: fact sheet}}
+
+    A fact sheet is {id, type, name, displayName, description, status, updatedAt,
+    tags, fields, rels : {LeanIX relation name: [(relation id, target id)]}}
+
+    Args:
+        apps (int): number of applications
+        interfaces_per_app (float): interfaces per application (fan-out)
+        max_consumers (int): consumers of an interface, 1 makes it a flow, more an interface
+        data_objects (int): number of data objects
+        tags_per_fact_sheet (int): tags of each application and interface
+        lifecycle_phases (int): lifecycle phases of each application and interface
+        child_ratio (float): share of applications that are the child of another one
+        malformed_ratio (float): share of interfaces not named "label (PROVIDER - CONSUMER)"
+        archived_ratio (float): share of archived applications
+        projects, it_components (int): fact sheets only read by a full extraction
+    """
+
+    def __init__(self, apps=500, interfaces_per_app=1.5, max_consumers=3, data_objects=50,
+                 tags_per_fact_sheet=2, lifecycle_phases=2, child_ratio=0.1,
+                 malformed_ratio=0.05, archived_ratio=0.01, projects=0, it_components=0, seed=1):
+        self.apps = apps
+        self.interfaces_per_app = interfaces_per_app
+        self.max_consumers = max_consumers
+        self.data_objects = data_objects
+        self.tags_per_fact_sheet = tags_per_fact_sheet
+        self.lifecycle_phases = lifecycle_phases
+        self.child_ratio = child_ratio
+        self.malformed_ratio = malformed_ratio
+        self.archived_ratio = archived_ratio
+        self.projects = projects
+        self.it_components = it_components
+        self.random = random.Random(seed)
+        self.fact_sheets = {}
+
+    def new_id(self):
+        # LeanIX ids are UUIDs
+        return str(uuid.UUID(int=self.random.getrandbits(128)))
+
+    def add(self, type, name):
+        id = self.new_id()
+        self.fact_sheets[id] = {'id': id, 'type': type, 'name': name, 'displayName': name,
+                                'description': f'{type} {name} : generated for benchmarking',
+                                'status': 'ACTIVE', 'updatedAt': UPDATED_AT,
+                                'tags': [], 'fields': [], 'rels': {}}
+        return self.fact_sheets[id]
+
+    def relate(self, fact_sheet, relation, target):
+        fact_sheet['rels'].setdefault(relation, []).append((self.new_id(), target['id']))
+
+    def describe(self, fact_sheet):
+        # Tags and fields read by manage_field
+        for group in self.random.sample(TAG_GROUPS, min(self.tags_per_fact_sheet, len(TAG_GROUPS))):
+            fact_sheet['tags'].append({'tagGroup': {'name': group},
+                                       'name': f'{group} {self.random.randrange(5)}'})
+        phases = [{'phase': phase, 'startDate': f'20{20 + i}-01-01'}
+                  for i, phase in enumerate(PHASES[:self.lifecycle_phases])]
+        fact_sheet['fields'].append({'name': 'lifecycle',
+                                     'data': {'type': 'Lifecycle', 'phases': phases}})
+        fact_sheet['fields'].append({'name': 'externalId',
+                                     'data': {'type': 'ExternalId',
+                                              'externalId': fact_sheet['id'][:8]}})
+
+    def generate(self):
+        rnd = self.random
+        apps = [self.add('Application', f'APP{i}') for i in range(self.apps)]
+        for app in apps:
+            self.describe(app)
+            if rnd.random() < self.archived_ratio:
+                app['status'] = 'ARCHIVED'
+        active_apps = [app for app in apps if app['status'] == 'ACTIVE'] or apps
+        for app in apps[1:]:
+            if rnd.random() < self.child_ratio:
+                self.relate(rnd.choice(apps), 'relToChild', app)
+        data_objects = [self.add('DataObject', f'DATA{i}') for i in range(self.data_objects)]
+
+        for i in range(int(self.apps * self.interfaces_per_app)):
+            provider = rnd.choice(active_apps)
+            consumers = rnd.sample(active_apps, min(len(active_apps), rnd.randint(0, self.max_consumers)))
+            consumer = consumers[0]['name'] if consumers else '?'
+            if rnd.random() < self.malformed_ratio:
+                name = f'Flux {i}'
+            else:
+                name = f"Flux {i} ({provider['name']} - {consumer})"
+            interface = self.add('Interface', name)
+            self.describe(interface)
+            self.relate(interface, 'relInterfaceToProviderApplication', provider)
+            for app in consumers:
+                self.relate(interface, 'relInterfaceToConsumerApplication', app)
+            if data_objects:
+                self.relate(interface, 'relInterfaceToDataObject', rnd.choice(data_objects))
+
+        # Only read by a full extraction
+        for i in range(self.projects):
+            project = self.add('Project', f'PRJ{i}')
+            for app in rnd.sample(active_apps, min(3, len(active_apps))):
+                self.relate(project, 'relProjectToApplication', app)
+        for i in range(self.it_components):
+            component = self.add('ITComponent', f'ITC{i}')
+            for app in rnd.sample(active_apps, min(3, len(active_apps))):
+                self.relate(component, 'relITComponentToApplication', app)
+        for app in active_apps:
+            if data_objects:
+                self.relate(app, 'relApplicationToDataObject', rnd.choice(data_objects))
+        return {'factSheets': self.fact_sheets}
@@ -8,11 +8,17 @@
 '''
 
 import requests
-import time
 import json
-
-from leanixAuthor import create_credential
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
+from httpTransport import get_default_transport, base_url
+from leanixAuthor import get_credential_manager
 from leanIXConverterModels import Model, Element, Relationship, Reader
+from runMetrics import RunMetrics, task_stage
 from customLog import get_default_logger
 
 __author__ = "Serge LASSABE"
@@ -25,91 +31,335 @@ def give_me_an_Id(label1, label2):
     return f"autogenerated-{label1}-{label2}"
 
 
+def ids_filter(ids):
+    ''' GraphQL fragments restricting an allFactSheets query to some fact sheets
+
+    Return the variable declaration and the filter entry, both empty if ids is None
+    '''
+    if ids:
+        return ', $ids: [ID!]', 'ids: $ids, '
+    return '', ''
+
+
+# Relations between FactSheets (full extract) : (FactSheet type, LeanIX relation, Archi relation)
+GENERIC_RELATIONS = [('Project', 'relProjectToApplication', 'Realization'),
+                     ('ITComponent', 'relITComponentToApplication', 'Serving'),
+                     ('Application', 'relApplicationToProcess', 'Realization'),
+                     ('Application', 'relApplicationToBusinessCapability', 'Realization'),
+                     ('Application', 'relApplicationToDataObject', 'Access'),
+                     ('ITComponent', 'relITComponentToTechnologyStack', 'Realization'),
+                     ('Application', 'relApplicationToUserGroup', 'Influence'),
+                     ('Project', 'relProjectToUserGroup', 'Influence')]
+
+
+_END_OF_ITERATION = object()
+
+
+def prefetch(iterable, depth=1):
+    ''' Iterate on iterable in a background thread, at most depth items ahead
+
+    Lets the caller process an item while the next one is produced (e.g. fetched).
+    An exception raised by iterable is raised again to the caller.
+    When the caller stops iterating (error, close), the background thread
+    stops too and iterable is closed.
+    '''
+    pending = queue.Queue(maxsize=depth)
+    stopping = threading.Event()
+
+    def put(entry):
+        # False once the caller stopped iterating : nobody reads the queue any more
+        while not stopping.is_set():
+            try:
+                pending.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if not put((item, None)):
+                    return
+            put((_END_OF_ITERATION, None))
+        except BaseException as exc:
+            put((_END_OF_ITERATION, exc))
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close:
+                close()
+
+    threading.Thread(target=produce, name='leanix-prefetch', daemon=True).start()
+    try:
+        while True:
+            item, exc = pending.get()
+            if item is _END_OF_ITERATION:
+                if exc:
+                    raise exc
+                return
+            yield item
+    finally:
+        stopping.set()
+
+
 class GraphQLReader(Reader):
-    def __init__(self, base_API, workspace, token, model):
+    def __init__(self, base_API, workspace, token, model, max_workers=4, page_size=100, cache=None,
+                 metrics=None):
         super().__init__(model)
         self.base_API = base_API
+        self.base_url = base_url(base_API)
         self.workspace = workspace
-        self.access_token = create_credential(self.base_API, token)
-        self.request_number = 0
+        self.max_workers = max_workers   # 1 : sequential extraction
+        self.page_size = page_size       # Fact sheets per GraphQL page
+        self.error_number = 0
+        self.transport = get_default_transport()
+        self.cache = cache               # ResponseCache, None to disable
+        self.metrics = metrics or RunMetrics(workspace)
+        if cache and cache.replay:
+            self.credential = None       # Replay : rebuild the model with zero network
+        else:
+            # Shared by the readers of the workspace, the token is fetched now
+            self.credential = get_credential_manager(self.base_API, token)
+            with self.metrics.stage('auth'):
+                self.credential.get_token()
+        self.watermark = None            # Most recent fact sheet update seen by LeanIX
+
+    def element_types(self, full_extract):
+        element_types = ['Application', 'DataObject']
+        if (full_extract):
+            element_types += ['Project', 'Process', 'ITComponent',
+                              'TechnicalStack', 'BusinessCapability', 'UserGroup']
+        return element_types
 
     def populate(self, full_extract):
-        # Manage FactSheets
-        self.manage_element('Application')
-        self.manage_element('DataObject')
+        # Updates made during the extraction are newer than the watermark
+        with self.metrics.stage('latest_update'):
+            self.watermark = self.latest_update(
+                self.element_types(full_extract) + ['Interface'])
+
+        # Manage FactSheets, interfaces, then relations between FactSheets :
+        # these extractions are independent from each other
+        tasks = [(self.manage_element, type)
+                 for type in self.element_types(full_extract)]
+        tasks.append((self.manage_interfaces,))
         if (full_extract):
-            self.manage_element('Project')
-            self.manage_element('Process')
-            self.manage_element('ITComponent')
-            self.manage_element('TechnicalStack')
-            self.manage_element('BusinessCapability')
-            self.manage_element('UserGroup')
-            # Then manage relations between FactSheets
-            self.manage_relProjectToApplication()
-            self.manage_relITComponentToApplication()
-            self.manage_relApplicationToProcess()
-            self.manage_relApplicationToBusinessCapability()
-            self.manage_relApplicationToData()
-            self.manage_relITComponentToTechnologyStack()
-            self.manage_relApplicationToUserGroup()
-            self.manage_relProjectToUserGroup()
+            tasks += [(self.manage_GenericRel, *relation)
+                      for relation in GENERIC_RELATIONS]
         # The Serving relation type is not allowed between the System Software and Flow relation concepts
         # self.manage_relITComponentToInterface()
+        self.run_concurrently(tasks)
 
-        # Last but not least...
-        self.manage_interfaces()
+        # Fields and data objects are set on the applications and interfaces
+        tasks = [(self.manage_fields, 'Application'),
+                 (self.manage_fields, 'Interface')]
         if (full_extract):
-            self.manage_relInterfaceToData()
-
-        # Manage fields
-        self.manage_field(self.getFields('Application'), 'Application')
-        self.manage_field(self.getFields('Interface'), 'Interface')
-
-    def postGraphQlRequest(self, request, variables):
-        self.request_number += 1
-
-        url = f'https://{self.base_API}/services/pathfinder/v1/graphql'
+            tasks.append((self.manage_relInterfaceToData,))
+        self.run_concurrently(tasks)
+        # Whatever the order the threads reached the model
+        self.model.sort_items()
+
+        # Last but not least... flow names need the applications
+        with self.metrics.stage('validate_flows'):
+            self.model.validate_flows()
+
+    def populate_incremental(self, full_extract, since):
+        ''' Merge into the model (built by a previous run) the fact sheets updated since the watermark
+
+        Items built from an updated fact sheet are removed then extracted again,
+        relations to archived fact sheets are removed.
+        The interfaces of an updated application are extracted again too : LeanIX
+        does not update an interface when its application is renamed or archived.
+        Return the number of updated fact sheets.
+        '''
+        types = self.element_types(full_extract) + ['Interface']
+        changes = {}    # {id: node}
+        with self.metrics.stage('iter_updates'):
+            for archived in (False, True):
+                for node in self.iter_updates(types, since, archived):
+                    changes.setdefault(node['id'], node)
+        self.watermark = max([since] + [node['updatedAt'] for node in changes.values()])
+        self.logger.info(f'{len(changes)} fact sheets updated since {since}')
+        if not changes:
+            return 0
+        updates = len(changes)
+        applications = [id for id, node in changes.items() if node['type'] == 'Application']
+        for id in self.model.linked_interfaces(applications):
+            changes.setdefault(id, {'id': id, 'type': 'Interface', 'status': 'ACTIVE'})
+        if len(changes) > updates:
+            self.logger.info(f'{len(changes) - updates} interfaces of updated applications extracted again')
+
+        self.model.remove_fact_sheets(
+            {id: node['status'] == 'ACTIVE' for id, node in changes.items()})
+        updated = {}    # {type: [id1, id2]}
+        for id, node in changes.items():
+            if node['status'] == 'ACTIVE':
+                updated.setdefault(node['type'], []).append(id)
+
+        # Same phases as populate, restricted to the updated fact sheets
+        interfaces = updated.get('Interface')
+        tasks = [(self.manage_element, type, ids)
+                 for type, ids in updated.items() if type != 'Interface']
+        if interfaces:
+            tasks.append((self.manage_interfaces, interfaces))
+        if (full_extract):
+            tasks += [(self.manage_GenericRel, *relation, updated[relation[0]])
+                      for relation in GENERIC_RELATIONS if relation[0] in updated]
+        self.run_concurrently(tasks)
+
+        tasks = [(self.manage_fields, type, updated[type])
+                 for type in ('Application', 'Interface') if updated.get(type)]
+        if (full_extract) and interfaces:
+            tasks.append((self.manage_GenericRel, 'Interface',
+                          'relInterfaceToDataObject', '', interfaces))
+        self.run_concurrently(tasks)
+        # Updated items are merged last : same order as a full extraction
+        self.model.sort_items()
+
+        # A renamed application may change the validity of flows not updated
+        with self.metrics.stage('validate_flows'):
+            self.model.validate_flows()
+        return updates
+
+    def iter_updates(self, types, since, archived=False, page_size=None):
+        ''' Yield the fact sheets (id, type, status, updatedAt) updated since since, most recent first '''
+        trash_bin = ', {facetKey: "TrashBin", keys: ["archived"]}' if archived else ''
+        query = f'''
+        query($types: [String], $first: Int, $cursor: String) {{
+          allFactSheets(first: $first, after: $cursor, sort: [{{key: "updatedAt", order: desc}}],
+                        filter: {{facetFilters: [{{facetKey: "FactSheetTypes", keys: $types}}{trash_bin}]}}) {{
+            pageInfo {{
+              hasNextPage
+              endCursor }}
+            edges {{
+              node {{
+                id
+                type
+                status
+                updatedAt}}}}}}}}
+                '''
+        for page in self.iter_pages(query, {'types': types}, page_size, kind='updates'):
+            for nodes in page['edges']:
+                node = nodes['node']
+                if since and node['updatedAt'] < since:
+                    return
+                yield node
+
+    def latest_update(self, types):
+        latest = None
+        for archived in (False, True):
+            for node in self.iter_updates(types, None, archived, page_size=1):
+                if latest is None or node['updatedAt'] > latest:
+                    latest = node['updatedAt']
+                break
+        return latest
+
+    def run_concurrently(self, tasks):
+        # tasks : list of (callable, *args), run at most max_workers at a time
+        tasks = [(self.metrics.timed(task_stage(task, args), task), *args) for task, *args in tasks]
+        if self.max_workers <= 1:
+            for task, *args in tasks:
+                task(*args)
+            return
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='leanix') as executor:
+            futures = [executor.submit(task, *args) for task, *args in tasks]
+            for future in futures:
+                future.result()     # Propagate the first error
+
+    def postGraphQlRequest(self, request, variables, kind='graphql'):
+        url = f'{self.base_url}/services/pathfinder/v1/graphql'
         if variables:
             request_ctxt = {'query': request, 'variables': variables}
         else:
             request_ctxt = {'query': request}
-        if False:
-            time.sleep(0.1)  # to avoid http errors
-        resp = requests.post(url, json=request_ctxt, headers={
-                             'Authorization': 'Bearer {}'.format(self.access_token)})
+        if self.cache:
+            key = self.cache.key(url, request_ctxt)
+            body = self.cache.get(key)
+            if body is not None:
+                self.metrics.record_cache_hit(kind)
+                return body
+        resp = self.transport.post(url, json=request_ctxt, credential=self.credential,
+                                   metrics=self.metrics, kind=kind)
         if resp.status_code != requests.codes.ok:
             self.logger.error(f'error for url : {url}')
             resp.raise_for_status()
 
-        errors = resp.json().get('errors')
+        body = resp.json()
+        errors = body.get('errors')
         if errors:
+            # Raised, not exit : the other workspaces of a batch go on
             self.logger.error(errors)
-            exit(1)
-        return resp
-
-    def manage_element(self, type):
-        query = '''
-        query($atype: String, $cursor: String) {
-          allFactSheets(first: 100, after: $cursor, filter: {facetFilters: [{facetKey: "FactSheetTypes", keys: [$atype]}]}) {
-            pageInfo {
+            raise RuntimeError(f'GraphQL errors : {errors}')
+        if self.cache:
+            self.cache.put(key, body)
+        return body
+
+    def getRestRequest(self, url, kind='rest'):
+        if self.cache:
+            key = self.cache.key(url)
+            body = self.cache.get(key)
+            if body is not None:
+                self.metrics.record_cache_hit(kind)
+                return body
+        resp = self.transport.get(url, credential=self.credential, metrics=self.metrics, kind=kind)
+        if resp.status_code != requests.codes.ok:
+            self.logger.error(f'error for url : {url}')
+            resp.raise_for_status()
+        body = resp.json()
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("\n<<<< getFactSheets : status: {} - elapsed: {} - response: {}\n".format(
+                resp.status_code, resp.elapsed.total_seconds(), json.dumps(body, indent=4)))
+        if self.cache:
+            self.cache.put(key, body)
+        return body
+
+    def iter_pages(self, request, variables=None, page_size=None, kind='graphql'):
+        ''' Yield the allFactSheets pages of a cursor paginated request
+
+        The request declares $first and $cursor variables, a page is
+        released by the caller before the next one is fetched.
+        kind : query kind the requests and pages are recorded under
+        '''
+        variables = {k: v for k, v in (variables or {}).items() if v is not None}
+        variables['first'] = page_size or self.page_size
+        cursor = ''
+        loopin = True
+        while loopin:
+            variables['cursor'] = cursor
+            page = self.postGraphQlRequest(request, variables, kind)['data']['allFactSheets']
+            self.metrics.record_page(kind)
+            pageinfo = page['pageInfo']
+            loopin = pageinfo['hasNextPage']
+            cursor = pageinfo['endCursor']
+            yield page
+
+    def manage_element(self, type, ids=None):
+        # One pass per type : the fact sheets and their parent to children relations
+        ids_declaration, ids_entry = ids_filter(ids)
+        query = f'''
+        query($atype: String, $first: Int, $cursor: String{ids_declaration}) {{
+          allFactSheets(first: $first, after: $cursor, filter: {{{ids_entry}facetFilters: [{{facetKey: "FactSheetTypes", keys: [$atype]}}]}}) {{
+            pageInfo {{
               hasNextPage
-              endCursor }
-            edges {
-              node {
+              endCursor }}
+            edges {{
+              node {{
                 displayName
                 id
                 description
-                status}}}}
+                status
+                ... on {type} {{
+                  relToChild {{
+                    edges {{
+                      node {{
+                        id
+                        factSheet {{
+                          id
+                          displayName}}}}}}}}}}}}}}}}}}
                 '''
 
-        loopin = True
-        cursor = ""
-        while loopin:
-            variables = "{\"atype\": \"" + type + \
-                "\", \"cursor\": \"" + cursor + "\"}"
-            resp = self.postGraphQlRequest(query, variables)
-            # Manage parent to children relations
-            for nodes in resp.json()['data']['allFactSheets']['edges']:
+        for page in self.iter_pages(query, {'atype': type, 'ids': ids}, kind=f'element:{type}'):
+            for nodes in page['edges']:
                 node = nodes['node']
                 if node['status'] == 'ACTIVE':
                     elt = Element(
@@ -117,97 +367,48 @@ class GraphQLReader(Reader):
                 else:
                     self.logger.info(
                         f'!!!!!!!!!!!!!!node {node["displayName"]} with status {node["status"]} discarded')
-            pageinfo = resp.json()['data']['allFactSheets']['pageInfo']
-            loopin = pageinfo['hasNextPage']
-            cursor = pageinfo['endCursor']
-            variables = "{\"atype\": \"" + type + \
-                "\", \"cursor\": \"" + cursor + "\"}"
-            # loopin = False  # uncomment for DEBUG purpose
-        self.manage_children(type)
-
-    def manage_children_aux(self, cursor, type):
-        return f"""{{
-          allFactSheets(first: 10, after: "{cursor}", filter: {{facetFilters: [{{facetKey: "FactSheetTypes", keys: ["{type}"]}}]}}) {{
-                pageInfo {{
-                  hasNextPage
-                  endCursor}}
-                edges {{
-                  node {{
-                    id
-                    name
-                    type
-                    ... on {type} {{
-                      relToChild {{
-                        edges {{
-                          node {{
-                            id
-                            factSheet {{
-                                id
-                                displayName
-                                }}
-                            }}}}}}
-                  }}}}}}
-            }}}}
-        """
-
-    def manage_children(self, type):
-        loopin = True
-        cursor = ''
-        while loopin:
-            resp = self.postGraphQlRequest(
-                self.manage_children_aux(cursor, type), None)
-            for edge in resp.json()['data']['allFactSheets']['edges']:
-                parent_id = edge['node']['id']
-                parent_name = edge['node']['name']
-                for child in edge['node']['relToChild']['edges']:
+                # Manage parent to children relations
+                parent_id = node['id']
+                for child in node['relToChild']['edges']:
                     rel_id = child['node']['id']
                     child_id = child['node']['factSheet']['id']
-                    child_name = child['node']['factSheet']['displayName']
                     rel = Relationship(self.model, rel_id, 'Composition',
                                        '', 'parent-child relation', parent_id, child_id)
-            pageinfo = resp.json()['data']['allFactSheets']['pageInfo']
-            loopin = pageinfo['hasNextPage']
-            cursor = pageinfo['endCursor']
-            # loopin = False  # uncomment for DEBUG purpose
 
-    def manage_interfaces(self):
-        graphQL_request = """
-            query($cursor: String) {
-              allFactSheets(first: 100, after: $cursor, factSheetType: Interface) {
-                pageInfo {
+    def manage_interfaces(self, ids=None):
+        ids_declaration, ids_entry = ids_filter(ids)
+        ids_argument = f', filter: {{{ids_entry}}}' if ids else ''
+        graphQL_request = f"""
+            query($first: Int, $cursor: String{ids_declaration}) {{
+              allFactSheets(first: $first, after: $cursor, factSheetType: Interface{ids_argument}) {{
+                pageInfo {{
                   hasNextPage
-                  endCursor }
-                edges {
-                  node {
+                  endCursor }}
+                edges {{
+                  node {{
                     name
                     type
                     id
                     description
-                      ...on Interface {
-                        relInterfaceToConsumerApplication {
-                          edges {
-                            node {
-                              factSheet {
+                      ...on Interface {{
+                        relInterfaceToConsumerApplication {{
+                          edges {{
+                            node {{
+                              factSheet {{
                                 id
                                 name
-                              }}}}
-                        relInterfaceToProviderApplication {
-                          edges {
-                            node {
-                              factSheet {
+                              }}}}}}}}
+                        relInterfaceToProviderApplication {{
+                          edges {{
+                            node {{
+                              factSheet {{
                                 id
                                 name
-                              }}}}}}}}}}
+                              }}}}}}}}}}}}}}}}}}}}
                               """
 
-        loopin = True
-        cursor = ""
-        while loopin:
-            variables = "{\"cursor\": \"" + cursor + "\"}"
-            resp = self.postGraphQlRequest(graphQL_request, variables)
-            #print(json.dumps(resp.json(), indent=4))
-            edges = resp.json()['data']['allFactSheets']['edges']
-            for nodes in edges:
+        for page in self.iter_pages(graphQL_request, {'ids': ids}, kind='interfaces'):
+            for nodes in page['edges']:
                 node = nodes['node']
 
                 node_provider = node['relInterfaceToProviderApplication']['edges']
@@ -219,9 +420,9 @@ class GraphQLReader(Reader):
                     node_name = node['name']
                     id_provider = give_me_an_Id('PROVIDER_UNDEF', node['id'])
                     self.model.warning(
-                        2, f'interface(id : {node_id}, name : {node_name})', 'manage_interfaces')
+                        2, f'interface(id : {node_id}, name : {node_name})', 'manage_interfaces', node['id'])
                     interface = Element(
-                        self.model, id_provider, node['type'], f"{self.model.interface_name_beautifier(node['name'])} (Fournisseur inconnu)", node['description'])
+                        self.model, id_provider, node['type'], f"{self.model.interface_name_beautifier(node['name'], node['id'])} (Fournisseur inconnu)", node['description'], origin=node['id'])
                     name_provider = 'Fournisseur inconnu'
                 else:
                     self.error_number += 1
@@ -230,12 +431,12 @@ class GraphQLReader(Reader):
                     self.logger.debug(
                         f'Error found (0) - interface(id : {node_id}, name : {node_name}) - multi provider')
                     interface = Element(
-                        self.model, node['id'], node['type'], f"ERROR: Multi provider for {node['name']}", node['description'])
+                        self.model, node['id'], node['type'], f"ERROR: Multi provider for {node['name']}", node['description'], origin=node['id'])
                     for current_provider in node_provider:
                         id_provider = current_provider['node']['factSheet']['id']
                         name_provider = current_provider['node']['factSheet']['name']
                         rel = Relationship(self.model, give_me_an_Id(
-                            node['id'], id_provider), 'Composition', '', 'Autogenerated relation', id_provider, node['id'])
+                            node['id'], id_provider), 'Composition', '', 'Autogenerated relation', id_provider, node['id'], origin=node['id'])
 
                 node_consumer = node['relInterfaceToConsumerApplication']['edges']
                 nb_consumer = len(node_consumer)
@@ -246,23 +447,22 @@ class GraphQLReader(Reader):
                         node_id = node['id']
                         node_name = node['name']
                         interface = Element(self.model, give_me_an_Id(
-                            'CONSUMER_UNDEF', node['id']), node['type'], f"{self.model.interface_name_beautifier(node['name'])} ({node_provider[0]['node']['factSheet']['name']})", node['description'])
+                            'CONSUMER_UNDEF', node['id']), node['type'], f"{self.model.interface_name_beautifier(node['name'], node['id'])} ({node_provider[0]['node']['factSheet']['name']})", node['description'], origin=node['id'])
                         rel = Relationship(self.model, give_me_an_Id(
-                            id_provider, node['id']), 'Composition', '', 'Autogenerated  relation', id_provider, interface.leanix_id)
+                            id_provider, node['id']), 'Composition', '', 'Autogenerated  relation', id_provider, interface.leanix_id, origin=node['id'])
                         self.model.warning(
-                            4, f'interface(id : {node_id}, name : {node_name})', 'manage_interfaces')
+                            4, f'interface(id : {node_id}, name : {node_name})', 'manage_interfaces', node['id'])
                     else:
                         # interface without consumer and without provider... DISCARDED
                         self.model.warning(
-                            3, f'interface(id : {node_id}, name : {node_name})', 'manage_interfaces')
+                            3, f'interface(id : {node_id}, name : {node_name})', 'manage_interfaces', node['id'])
                     # TO REMOVE: continue
                 elif nb_consumer == 1:
                     # This is a flow
+                    # Its name is checked once the applications are extracted
                     id_consumer = node_consumer[0]['node']['factSheet']['id']
-                    self.model.check_flow_name(
-                        node['name'], id_provider, id_consumer)
                     rel = Relationship(
-                        self.model, node['id'], 'Flow', node['name'], node['description'], id_provider, id_consumer)
+                        self.model, node['id'], 'Flow', node['name'], node['description'], id_provider, id_consumer, origin=node['id'])
                 else:
                     # This is an Interface
                     #  <provider app> --> <Interface> --> <consumers>
@@ -270,24 +470,22 @@ class GraphQLReader(Reader):
                     # Build a new id to resolve mutable objets (Flow <-> Interface)
                     new_intf_id = give_me_an_Id('INTF_', intf_id)
                     interface = Element(
-                        self.model, new_intf_id, node['type'], f"{self.model.interface_name_beautifier(node['name'])} ({name_provider})", node['description'])
+                        self.model, new_intf_id, node['type'], f"{self.model.interface_name_beautifier(node['name'], node['id'])} ({name_provider})", node['description'], origin=node['id'])
                     rel = Relationship(self.model, give_me_an_Id(
-                        id_provider, intf_id), 'Composition', '', 'Autogenerated relation', id_provider, new_intf_id)
+                        id_provider, intf_id), 'Composition', '', 'Autogenerated relation', id_provider, new_intf_id, origin=node['id'])
                     for current_consumer in node_consumer:
                         id_consumer = current_consumer['node']['factSheet']['id']
                         rel = Relationship(self.model, give_me_an_Id(
-                            intf_id, id_consumer), 'Serving', '', 'Autogenerated relation', new_intf_id, id_consumer)
-
-            pageinfo = resp.json()['data']['allFactSheets']['pageInfo']
-            loopin = pageinfo['hasNextPage']
-            cursor = pageinfo['endCursor']
-            variables = "{\"cursor\": \"" + cursor + "\"}"
-            #loopin = False
-
-    def manage_GenericRel(self, object_type, relation_type_leanix, relation_type_archi):
-        query = f""" {{
-              allFactSheets(filter: {{facetFilters: [{{facetKey: "FactSheetTypes", keys: ["{object_type}"]}}]}}) {{
-                    totalCount
+                            intf_id, id_consumer), 'Serving', '', 'Autogenerated relation', new_intf_id, id_consumer, origin=node['id'])
+
+    def manage_GenericRel(self, object_type, relation_type_leanix, relation_type_archi, ids=None):
+        ids_declaration, ids_entry = ids_filter(ids)
+        query = f"""
+            query($first: Int, $cursor: String{ids_declaration}) {{
+              allFactSheets(first: $first, after: $cursor, filter: {{{ids_entry}facetFilters: [{{facetKey: "FactSheetTypes", keys: ["{object_type}"]}}]}}) {{
+                    pageInfo {{
+                      hasNextPage
+                      endCursor }}
                     edges {{
                       node {{
                         id
@@ -306,31 +504,30 @@ class GraphQLReader(Reader):
                                   type
                                   }}}}}}}}}}}}}}}}}}
         """
-        variables = "{\"relType\": \"" + relation_type_leanix + "\"}"
-        resp = self.postGraphQlRequest(query, variables)
-        edges = resp.json()['data']['allFactSheets']['edges']
-        for nodes in edges:
-            node_p = nodes['node']
-
-            rel_nodes = node_p[relation_type_leanix]['edges']
-
-            for nodes in rel_nodes:
-                node_r = nodes['node']
-                id_rel = node_r['id']
-                id_src = node_p['id']
-                id_target = node_r['factSheet']['id']
-                if (object_type == 'Interface'):
-                    data_name = node_r["factSheet"]["name"]
-                    rel_src = self.model.get_rel(id_src)
-                    if (rel_src):
-                        rel_src.set_tags(
-                            self.model, 'LEANIX.DATA_OBJECT', data_name)
+        # Each page is processed, then released before the next one is fetched
+        for page in self.iter_pages(query, {'ids': ids}, kind=f'relation:{relation_type_leanix}'):
+            for nodes in page['edges']:
+                node_p = nodes['node']
+
+                rel_nodes = node_p[relation_type_leanix]['edges']
+
+                for nodes in rel_nodes:
+                    node_r = nodes['node']
+                    id_rel = node_r['id']
+                    id_src = node_p['id']
+                    id_target = node_r['factSheet']['id']
+                    if (object_type == 'Interface'):
+                        data_name = node_r["factSheet"]["name"]
+                        rel_src = self.model.get_rel(id_src)
+                        if (rel_src):
+                            rel_src.set_tags(
+                                self.model, 'LEANIX.DATA_OBJECT', data_name)
+                        else:
+                            self.logger.debug(
+                                f'!!! ERROR in manage_GenericRel (1) : cannot retrieve interface named {node_p["displayName"]}')
                     else:
-                        self.logger.errodebugr(
-                            f'!!! ERROR in manage_GenericRel (1) : cannot retrieve interface named {node_p["displayName"]}')
-                else:
-                    real = Relationship(
-                        self.model, id_rel, relation_type_archi, None, None, id_src, id_target)
+                        real = Relationship(
+                            self.model, id_rel, relation_type_archi, None, None, id_src, id_target)
 
     def manage_relProjectToApplication(self):
         self.manage_GenericRel('Project', 'ITComponent',
@@ -381,34 +578,46 @@ class GraphQLReader(Reader):
     #   - grahQL request is not adapted to access easily fields
     ##
     def formatURL(self, pageSize, cursor, type):
-        self.request_number += 1
         if cursor:
-            return f'https://{self.base_API}/services/pathfinder/v1/factSheets?type={type}&pageSize={pageSize}&cursor={cursor}&permissions=true'
+            return f'{self.base_url}/services/pathfinder/v1/factSheets?type={type}&pageSize={pageSize}&cursor={cursor}&permissions=true'
         else:
-            return f'https://{self.base_API}/services/pathfinder/v1/factSheets?type={type}&pageSize={pageSize}'
+            return f'{self.base_url}/services/pathfinder/v1/factSheets?type={type}&pageSize={pageSize}'
 
-    def getFields(self, type):
+    def getFieldsPages(self, type):
         pageSize = 80
-        sheetList = []
         count = 0
         cursor = None
         loopin = True
 
         while loopin:
-            url = self.formatURL(pageSize, cursor, type)
-            resp = requests.get(
-                url, headers={'Authorization': 'Bearer {}'.format(self.access_token)})
-            self.logger.debug("\n<<<< getFactSheets : status: {} - elapsed: {} - response: {}\n".format(
-                resp.status_code, resp.elapsed.total_seconds(), json.dumps(resp.json(), indent=4)))
-            subList = resp.json()['data']
-            cursor = resp.json()['cursor']
+            body = self.getRestRequest(self.formatURL(pageSize, cursor, type), f'fields:{type}')
+            self.metrics.record_page(f'fields:{type}')
+            subList = body['data']
+            cursor = body['cursor']
             count += len(subList)
-            sheetList = sheetList + subList
-            self.logger.debug(">> total : {} - result length : {}".format(resp.json()
-                                                                          ['total'], len(sheetList)))
-            loopin = count < resp.json()['total']
-            #loopin = False
-        return sheetList
+            self.logger.debug(">> total : %s - result length : %s", body['total'], count)
+            loopin = len(subList) > 0 and count < body['total']
+            yield subList
+
+    def getFields(self, type):
+        # Records are yielded as soon as their page is parsed, the next page
+        # is fetched in background meanwhile
+        with closing(prefetch(self.getFieldsPages(type))) as pages:
+            for subList in pages:
+                yield from subList
+
+    def getFieldsByIds(self, ids):
+        for id in ids:
+            yield self.getRestRequest(
+                f'{self.base_url}/services/pathfinder/v1/factSheets/{id}', 'fact_sheet')['data']
+
+    def manage_fields(self, type, ids=None):
+        if ids:
+            self.manage_field(self.getFieldsByIds(ids), type)
+        else:
+            # Closed on error : the page prefetching stops at once
+            with closing(self.getFields(type)) as values_list:
+                self.manage_field(values_list, type)
 
     def manage_field(self, values_list, type):
         for entry in values_list:
@@ -7,9 +7,10 @@
    - Convert Model in Archi file format : OEF (Open Exchange File)
 '''
 
-import xml.etree.ElementTree as ET
-from xml.dom import minidom
+import io
+import re
 from leanIXConverterModels import Model, Writer
+from outputCompression import open_compressed, compressed_name
 from customLog import get_default_logger
 
 __author__ = "Serge LASSABE"
@@ -17,6 +18,82 @@ __copyright__ = "Copyright (C) 2023, Serge LASSABE"
 __license__ = "agpl-3.0"
 __version__ = "5.0.1"
 
+# Characters not allowed by XML 1.0 (e.g. the 0x0b char found in LeanIX descriptions)
+INVALID_XML_CHARS = re.compile('[^\t\n\r\x20-\ud7ff\ue000-\ufffd\U00010000-\U0010ffff]')
+
+
+def xml_escape(value):
+    ''' Escape a text or attribute value, invalid characters are replaced by @ '''
+    text = INVALID_XML_CHARS.sub('@', str(value))
+    # End of lines are normalized as an XML parser does
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('"', '&quot;').replace('>', '&gt;')
+
+# LeanIX fact sheet type -> Archimate element type
+LEAN2ARCHI = {'Application':    'ApplicationComponent',
+              'Project':        'WorkPackage',
+              'Process':        'BusinessProcess',
+              'DataObject':     'DataObject',
+              'ITComponent':    'SystemSoftware',
+              'Interface':      'ApplicationInterface',
+              'TechnicalStack': 'TechnologyService',
+              'BusinessCapability': 'Capability',
+              'UserGroup':      'Stakeholder'
+              }
+
+# Properties set on every item -> property definition identifier
+PROPERTY_REFS = {'LEANIX.ID':     'propid-1',
+                 'LEANIX.NAME':   'propid-2',
+                 'LEANIX.SOURCE': 'propid-3',
+                 'LEANIX.TARGET': 'propid-4'}
+
+
+class OEFStream():
+    ''' Write an XML document to a text file, node after node
+
+    The layout is the one of minidom toprettyxml : one node per line, indented,
+    text nodes inline and empty nodes self-closed.
+    Compact layout (indent='', newline='') : the whole document on one line.
+    '''
+
+    def __init__(self, output, indent='   ', newline='\n'):
+        self.output = output
+        self.indent = indent
+        self.newline = newline
+        self.depth = 0
+        self.write = output.write
+
+    @staticmethod
+    def attributes(attrib):
+        # attrib : a dict, or attributes already rendered by attributes()
+        if not attrib:
+            return ''
+        if isinstance(attrib, str):
+            return attrib
+        return ''.join(f' {k}="{xml_escape(v)}"' for k, v in attrib.items())
+
+    def declaration(self):
+        # The declaration keeps its line : the document is still read line by line
+        self.write('<?xml version="1.0" ?>\n')
+
+    def comment(self, text):
+        self.write(f'{self.indent * self.depth}<!--{text}-->{self.newline}')
+
+    def start(self, tag, attrib=None):
+        self.write(f'{self.indent * self.depth}<{tag}{self.attributes(attrib)}>{self.newline}')
+        self.depth += 1
+
+    def end(self, tag):
+        self.depth -= 1
+        self.write(f'{self.indent * self.depth}</{tag}>{self.newline}')
+
+    def leaf(self, tag, attrib=None, text=None):
+        if text:
+            self.write(f'{self.indent * self.depth}<{tag}{self.attributes(attrib)}>{xml_escape(text)}</{tag}>{self.newline}')
+        else:
+            self.write(f'{self.indent * self.depth}<{tag}{self.attributes(attrib)}/>{self.newline}')
+
+
 class XmlArchiWriter(Writer):
     ID1 = 'id-autogenerated-DIAGRAM01'
     ID2 = 'id-autogenerated-LABEL01'
@@ -30,204 +107,195 @@ class XmlArchiWriter(Writer):
     LANG_ATTR =         {'xml:lang': "fr"}
 
     def tostring(self, notes):
+        output = io.StringIO()
+        self.write_oef(OEFStream(output), notes)
+        return output.getvalue()
+
+    def write_oef(self, stream, notes):
         # Use it and pray
         ATTR = {'xmlns': "http://www.opengroup.org/xsd/archimate/3.0/",
                 'xmlns:xsi': "http://www.w3.org/2001/XMLSchema-instance",
                 'xsi:schemaLocation': "http://www.opengroup.org/xsd/archimate/3.0/ http://www.opengroup.org/xsd/archimate/3.1/archimate3_Diagram.xsd",
                 'identifier': "id-110f4dff-c3c9-437c-91aa-ffe7df582fe6"}
-        root = ET.Element('model', attrib=ATTR)
-        root.append(ET.Comment("Autogenerated Archi file"))
-        name = ET.SubElement(root, self.NAME_KEY, self.LANG_ATTR)
-        name.text="Export LeanIX Content"
+        stream.declaration()
+        stream.start('model', ATTR)
+        stream.comment("Autogenerated Archi file")
+        stream.leaf(self.NAME_KEY, self.LANG_ATTR, "Export LeanIX Content")
 
         # First : format application components
-        elements_xml = ET.SubElement(root, 'elements')
+        stream.start('elements')
+        archi_elt = ArchiElement(self.model)
         for elt in self.model.get_elt_values():
-            archi_elt = ArchiElement(self.model, elt)
-            archi_elt.to_xml(elements_xml)
+            archi_elt.to_xml(stream, elt)
+        stream.end('elements')
         # Add relationships
-        relationships_xml = ET.SubElement(root, 'relationships')
+        stream.start('relationships')
+        archi_rel = ArchiRelationship(self.model)
         for rel in self.model.get_rel_values():
-            archi_rel = ArchiRelationship(self.model, rel)
-            archi_rel.to_xml(relationships_xml)
-        ArchiOrganizations(self.model).to_xml(root)
-        self.add_propertyDefinitions_xml(root)
-        ArchiViews(self.model, notes).to_xml(root)
-        tmp = ET.tostring(root, encoding="unicode")
-
-        ## Emergency mode : replace this fucking 0x0b char
-        tmp = tmp.replace('', '@')
-        return minidom.parseString(tmp).toprettyxml(indent="   ")
-
-    def add_propertyDefinitions_xml(self, to):
-        propertyDefinitions_xml = ET.SubElement(to, 'propertyDefinitions')
-        propertyDefinition_xml = ET.SubElement(propertyDefinitions_xml, 'propertyDefinition', attrib={'identifier': "propid-1", 'type': "string"})
-        name_xml = ET.SubElement(propertyDefinition_xml, 'name')
-        name_xml.text = 'LEANIX.ID'
-        propertyDefinition_xml = ET.SubElement(propertyDefinitions_xml, 'propertyDefinition', attrib={'identifier': "propid-2", 'type': "string"})
-        name_xml = ET.SubElement(propertyDefinition_xml, 'name')
-        name_xml.text = 'LEANIX.NAME'
-        propertyDefinition_xml = ET.SubElement(propertyDefinitions_xml, 'propertyDefinition', attrib={'identifier': "propid-3", 'type': "string"})
-        name_xml = ET.SubElement(propertyDefinition_xml, 'name')
-        name_xml.text = 'LEANIX.SOURCE'
-        propertyDefinition_xml = ET.SubElement(propertyDefinitions_xml, 'propertyDefinition', attrib={'identifier': "propid-4", 'type': "string"})
-        name_xml = ET.SubElement(propertyDefinition_xml, 'name')
-        name_xml.text = 'LEANIX.TARGET'
+            archi_rel.to_xml(stream, rel)
+        stream.end('relationships')
+        ArchiOrganizations(self.model).to_xml(stream)
+        self.add_propertyDefinitions_xml(stream)
+        ArchiViews(self.model, notes).to_xml(stream)
+        stream.end('model')
+
+    def add_propertyDefinitions_xml(self, stream):
+        stream.start('propertyDefinitions')
+        for name, identifier in PROPERTY_REFS.items():
+            stream.start('propertyDefinition', {'identifier': identifier, 'type': "string"})
+            stream.leaf('name', text=name)
+            stream.end('propertyDefinition')
         ## Manage tag properties
-        for tag in self.model.tags_refs:
-            propertyDefinition_xml = ET.SubElement(propertyDefinitions_xml, 'propertyDefinition', attrib={'identifier': self.model.tags_refs[tag], 'type': "string"})
-            name_xml = ET.SubElement(propertyDefinition_xml, 'name')
-            name_xml.text = tag
+        for tag in self.model.tag_names:
+            stream.start('propertyDefinition', {'identifier': self.model.tags_refs[tag], 'type': "string"})
+            stream.leaf('name', text=tag)
+            stream.end('propertyDefinition')
+
+        stream.end('propertyDefinitions')
+
+    def dump(self, output_name, notes, compression=None, compact=False):
+        """ Write the document as it is produced, never held in memory
+
+        Args:
+            compression (str): gzip, zstd or zip, the document is compressed on the fly
+            compact (bool): without indentation nor end of lines
+        Return the written file (output_name with the compression suffix)
+        """
+        with open_compressed(output_name, compression, text=True) as output:
+            if compact:
+                self.write_oef(OEFStream(output, indent='', newline=''), notes)
+            else:
+                self.write_oef(OEFStream(output), notes)
+        return compressed_name(output_name, compression)
 
+    def normalize(self, id_LeanIX):
+            return f"id-{id_LeanIX}"
 
-    def dump(self, output_name, notes):
-        with open(output_name, 'w', encoding='utf-8') as output:
-            xml_model = self.tostring(notes)
-            output.write(xml_model)
 
-    ## Convenient function used to format XML
-    def add_properties_xml(self, to):
-        # Return the 'properties' XML node created
-        properties_xml = ET.SubElement(to, 'properties')
-        property_xml = ET.SubElement(properties_xml, 'property', attrib={'propertyDefinitionRef': 'propid-1'})
-        value_xml = ET.SubElement(property_xml, 'value', self.LANG_ATTR)
-        value_xml.text = self.leanix_id
-        property_xml = ET.SubElement(properties_xml, 'property', attrib={'propertyDefinitionRef': 'propid-2'})
-        value_xml = ET.SubElement(property_xml, 'value', self.LANG_ATTR)
-        value_xml.text = self.leanix_name
-        # Property tags
-        for tag in self.tags:
-            property_xml = ET.SubElement(properties_xml, 'property', attrib={'propertyDefinitionRef': self.model.tags_refs[tag]})
-            value_xml = ET.SubElement(property_xml, 'value', self.LANG_ATTR)
-            value_xml.text = self.tags[tag]
+class ArchiItem():
+    ''' Serialize model items, one serializer for the whole document
 
-        return properties_xml
+    Items are read directly from the model, property references are
+    computed once per document instead of once per item.
+    '''
+    __slots__ = ('model', 'logger', 'property_attrs', 'value_attrs')
 
-    def normalize(self, id_LeanIX):
-            return f"id-{id_LeanIX}"
+    def __init__(self, model):
+        self.model = model
+        self.logger = model.logger
+        # Attributes are rendered once : {propid or tag index: ' propertyDefinitionRef="..."'}
+        self.property_attrs = {}
+        for key, ref in [(ref, ref) for ref in PROPERTY_REFS.values()] + \
+                [(index, model.tags_refs[tag]) for index, tag in enumerate(model.tag_names)]:
+            self.property_attrs[key] = OEFStream.attributes({'propertyDefinitionRef': ref})
+        self.value_attrs = OEFStream.attributes(XmlArchiWriter.LANG_ATTR)
 
-class ArchiElement(XmlArchiWriter):
-    def __init__(self, model, elt):
-        LEAN2ARCHI = {'Application':    'ApplicationComponent',
-                      'Project':        'WorkPackage',
-                      'Process':        'BusinessProcess',
-                      'DataObject':     'DataObject',
-                      'ITComponent':    'SystemSoftware',
-                      'Interface':      'ApplicationInterface',
-                      'TechnicalStack': 'TechnologyService',
-                      'BusinessCapability': 'Capability',
-                      'UserGroup':      'Stakeholder'
-                      }
+    ## Convenient function used to format XML
+    def add_property_xml(self, stream, attrs, value):
+        stream.start('property', attrs)
+        stream.leaf('value', self.value_attrs, value)
+        stream.end('property')
+
+    def add_properties_xml(self, stream, item):
+        property_attrs = self.property_attrs
+        stream.start('properties')
+        self.add_property_xml(stream, property_attrs['propid-1'], item.leanix_id)
+        self.add_property_xml(stream, property_attrs['propid-2'], item.leanix_name)
+        # Property tags
+        for tag, value in item.tags.items():
+            self.add_property_xml(stream, property_attrs[tag], value)
+        self.add_more_properties_xml(stream, item)
+        stream.end('properties')
 
-        super().__init__(model)
-        self.leanix_id = elt.leanix_id
-        self.leanix_type = elt.leanix_type
-        self.leanix_name = elt.leanix_name
-        self.doc = elt.doc
-        self.tags = elt.tags
+    def add_more_properties_xml(self, stream, item):
+        return
 
-        self.archi_id = self.normalize(elt.leanix_id)
-        self.archi_type = LEAN2ARCHI[elt.leanix_type]
 
-    def __str__(self):
-        return "ArchiElement(id = {}, type = {}, name = {}, doc = {})".format(self.leanix_id, self.leanix_type, self.leanix_name, self.doc)
+class ArchiElement(ArchiItem):
+    __slots__ = ()
 
-    def to_xml(self, attached_to):
-        element_xml = ET.SubElement(attached_to, 'element', attrib={self.IDENTIFIER_KEY: self.archi_id,
-                                                                    self.TYPE_KEY: self.archi_type})
-        name_xml = ET.SubElement(element_xml, self.NAME_KEY, self.LANG_ATTR)
-        name_xml.text = self.leanix_name
+    def to_xml(self, stream, elt):
+        stream.start('element', {XmlArchiWriter.IDENTIFIER_KEY: f'id-{elt.leanix_id}',
+                                 XmlArchiWriter.TYPE_KEY: LEAN2ARCHI[elt.leanix_type]})
+        stream.leaf(XmlArchiWriter.NAME_KEY, self.value_attrs, elt.leanix_name)
 
-        if self.doc:
-            doc_xml = ET.SubElement(element_xml, self.DOC_KEY, self.LANG_ATTR)
-            doc_xml.text = self.doc
+        if elt.doc:
+            stream.leaf(XmlArchiWriter.DOC_KEY, self.value_attrs, elt.doc)
 
         # Add properties
-        self.add_properties_xml(element_xml)
+        self.add_properties_xml(stream, elt)
+        stream.end('element')
 
-class ArchiRelationship(XmlArchiWriter):
-    def __init__(self, model, elt):
-        super().__init__(model)
-        self.leanix_id = elt.leanix_id
 
-        self.leanix_name = elt.leanix_name
-        self.leanix_source = elt.leanix_source
-        self.leanix_target = elt.leanix_target
-        self.doc = elt.doc
-        self.tags = elt.tags
+class ArchiRelationship(ArchiItem):
+    __slots__ = ()
+
+    def add_more_properties_xml(self, stream, rel):
+        if rel.leanix_source:
+            self.add_property_xml(stream, self.property_attrs['propid-3'], rel.leanix_source)
+        if rel.leanix_target:
+            self.add_property_xml(stream, self.property_attrs['propid-4'], rel.leanix_target)
 
-        self.archi_id = self.normalize(elt.leanix_id)
-        self.archi_type = elt.type
+    def archi_name(self, rel):
         try:
-            self.archi_name = self.model.interface_name_beautifier(self.leanix_name)
+            # A flow has the id of its interface
+            return self.model.interface_name_beautifier(rel.leanix_name, rel.leanix_id)
         except AttributeError:
-            self.logger.error(f'leanix_id: {self.leanix_id} - archi_type: {self.archi_type} - leanix_name: {self.leanix_name} - leanix_source: {self.leanix_source} - leanix_target: {self.leanix_target}')
-            self.archi_name = 'undef'
-        self.archi_source = self.normalize(elt.leanix_source)
-        self.archi_target = self.normalize(elt.leanix_target)
-
-    def __str__(self):
-        return f"ArchiRelationship(id = {self.leanix_id}, type = {self.archi_type}, name = {self.leanix_name}, from = {self.archi_source}, to = {self.archi_target}, doc = {self.doc})"
-
-    def add_properties_xml(self, to):
-        properties_xml = super().add_properties_xml(to)
-        if self.leanix_source:
-            property_xml = ET.SubElement(properties_xml, 'property', attrib={'propertyDefinitionRef': 'propid-3'})
-            value_xml = ET.SubElement(property_xml, 'value', self.LANG_ATTR)
-            value_xml.text = self.leanix_source
-        if self.leanix_target:
-            property_xml = ET.SubElement(properties_xml, 'property', attrib={'propertyDefinitionRef': 'propid-4'})
-            value_xml = ET.SubElement(property_xml, 'value', self.LANG_ATTR)
-            value_xml.text = self.leanix_target
-
-    def to_xml(self, attached_to):
-        relationship_xml = ET.SubElement(attached_to, 'relationship', attrib={self.IDENTIFIER_KEY:   self.archi_id,
-                                                                              self.SOURCE_KEY:       self.archi_source,
-                                                                              self.TARGET_KEY:       self.archi_target,
-                                                                              self.TYPE_KEY:         self.archi_type})
+            self.logger.error(f'leanix_id: {rel.leanix_id} - archi_type: {rel.type} - leanix_name: {rel.leanix_name} - leanix_source: {rel.leanix_source} - leanix_target: {rel.leanix_target}')
+            return 'undef'
+
+    def to_xml(self, stream, rel):
+        stream.start('relationship', {XmlArchiWriter.IDENTIFIER_KEY:   f'id-{rel.leanix_id}',
+                                      XmlArchiWriter.SOURCE_KEY:       f'id-{rel.leanix_source}',
+                                      XmlArchiWriter.TARGET_KEY:       f'id-{rel.leanix_target}',
+                                      XmlArchiWriter.TYPE_KEY:         rel.type})
         # The relashionship label is very (too ?) long...
         # so try to extract data information and save all stuff in the documentation
-        if len(self.archi_name) > 1:
-            name_xml = ET.SubElement(relationship_xml, self.NAME_KEY, self.LANG_ATTR)
-            name_xml.text = self.archi_name
+        archi_name = self.archi_name(rel)
+        if len(archi_name) > 1:
+            stream.leaf(XmlArchiWriter.NAME_KEY, self.value_attrs, archi_name)
 
-        if self.doc:
-            doc_xml = ET.SubElement(relationship_xml, self.DOC_KEY, self.LANG_ATTR)
-            doc_xml.text = self.doc
+        if rel.doc:
+            stream.leaf(XmlArchiWriter.DOC_KEY, self.value_attrs, rel.doc)
 
         # Add properties
-        self.add_properties_xml(relationship_xml)
+        self.add_properties_xml(stream, rel)
+        stream.end('relationship')
 
 class ArchiOrganizations(XmlArchiWriter):
     def __init__(self, model):
         super().__init__(model)
         return
 
-    def to_xml(self, attached_to):
-        orga_xml_l1 = ET.SubElement(attached_to, 'organizations')
-        orga_xml_l1a = ET.SubElement(orga_xml_l1, 'item')
-        orga_xml_l1aa = ET.SubElement(orga_xml_l1a, 'label', attrib=self.LANG_ATTR)
-        orga_xml_l1aa.text = 'Views'
-        orga_xml_l1ab = ET.SubElement(orga_xml_l1a, 'item', attrib={self.IDENTIFIER_REF_KEY: self.ID1})
+    def to_xml(self, stream):
+        stream.start('organizations')
+        stream.start('item')
+        stream.leaf('label', self.LANG_ATTR, 'Views')
+        stream.leaf('item', {self.IDENTIFIER_REF_KEY: self.ID1})
+        stream.end('item')
+        stream.end('organizations')
 
 class ArchiViews(XmlArchiWriter):
     def __init__(self, model, release_notes):
         super().__init__(model)
         self.content = release_notes
 
-    def to_xml(self, attached_to):
-        orga_xml_l2 = ET.SubElement(attached_to, 'views')
-        orga_xml_l2a = ET.SubElement(orga_xml_l2, 'diagrams')
-        orga_xml_l2aa = ET.SubElement(orga_xml_l2a, 'view', attrib={self.IDENTIFIER_KEY: self.ID1,
-                                                                    self.TYPE_KEY: "Diagram"})
-        orga_xml_l2aaa = ET.SubElement(orga_xml_l2aa, 'name', attrib=self.LANG_ATTR)
-        orga_xml_l2aaa.text = 'Release Notes'
-        orga_xml_l2aab = ET.SubElement(orga_xml_l2aa, 'node', attrib={self.IDENTIFIER_KEY: self.ID2,
-                                                                      self.TYPE_KEY: "Label",
-                                                                      'x': "50", 'y': "40", 'w': "700", 'h': "900"})
-        orga_xml_l2aaba = ET.SubElement(orga_xml_l2aab, 'label', attrib=self.LANG_ATTR)
-        orga_xml_l2aaba.text = self.content
-        orga_xml_l2aabb = ET.SubElement(orga_xml_l2aab, 'style')
-        orga_xml_l2aabba = ET.SubElement(orga_xml_l2aabb, 'fillColor', attrib={'r': "255", 'g': "212", 'b': "120", 'a': "100"})
-        orga_xml_l2aabbb = ET.SubElement(orga_xml_l2aabb, 'lineColor', attrib={'r': "92", 'g': "92", 'b': "92", 'a': "100"})
-        orga_xml_l2aabbc = ET.SubElement(orga_xml_l2aabb, 'font', attrib={'name': 'Courrier', 'size': '10'})
+    def to_xml(self, stream):
+        stream.start('views')
+        stream.start('diagrams')
+        stream.start('view', {self.IDENTIFIER_KEY: self.ID1,
+                              self.TYPE_KEY: "Diagram"})
+        stream.leaf('name', self.LANG_ATTR, 'Release Notes')
+        stream.start('node', {self.IDENTIFIER_KEY: self.ID2,
+                              self.TYPE_KEY: "Label",
+                              'x': "50", 'y': "40", 'w': "700", 'h': "900"})
+        stream.leaf('label', self.LANG_ATTR, self.content)
+        stream.start('style')
+        stream.leaf('fillColor', {'r': "255", 'g': "212", 'b': "120", 'a': "100"})
+        stream.leaf('lineColor', {'r': "92", 'g': "92", 'b': "92", 'a': "100"})
+        stream.leaf('font', {'name': 'Courrier', 'size': '10'})
+        stream.end('style')
+        stream.end('node')
+        stream.end('view')
+        stream.end('diagrams')
+        stream.end('views')
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ Purpose :
+   Dump LeanIx and convert output in various file format
+   - Export the model as columnar datasets : elements, relationships, tags, warnings
+     Parquet when pyarrow is installed, CSV or JSON Lines otherwise
+'''
+
+import csv
+import json
+from itertools import islice
+from pathlib import Path
+from leanIXConverterModels import Model, Writer
+from customLog import get_default_logger
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:     # Optional : CSV and JSON Lines only
+    pyarrow = None
+
+__author__ = "Serge LASSABE"
+__copyright__ = "Copyright (C) 2023, Serge LASSABE"
+__license__ = "agpl-3.0"
+__version__ = "5.0.1"
+
+FORMATS = ['parquet', 'csv', 'jsonl']
+CHUNK_ROWS = 50000      # Rows per Parquet row group, rows held in memory
+
+# Dataset name -> [(column name, dictionary encoded)]
+# Dictionary encoded columns have few distinct values (types, tag names...)
+DATASETS = {'elements':      [('id', False), ('type', True), ('name', False),
+                              ('description', False)],
+            'relationships': [('id', False), ('type', True), ('name', False),
+                              ('description', False), ('source', False), ('target', False)],
+            'tags':          [('id', False), ('kind', True), ('tag', True), ('value', False)],
+            'warnings':      [('type', True), ('description', True), ('context', False)]}
+
+
+def default_format():
+    return 'parquet' if pyarrow else 'csv'
+
+
+def chunks(rows, size=CHUNK_ROWS):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class ColumnarWriter(Writer):
+    def dump(self, output_dir, prefix, format=None):
+        """ Write one file per dataset : <output_dir>/<prefix>-<dataset>.<format>
+
+        Args:
+            format (str): parquet, csv or jsonl - parquet if pyarrow is installed, csv otherwise
+        Return the written files
+        """
+        format = format or default_format()
+        if format not in FORMATS:
+            raise ValueError(f'unknown columnar format {format}, expected one of {FORMATS}')
+        if format == 'parquet' and not pyarrow:
+            self.logger.warning('pyarrow is not installed : columnar export in csv')
+            format = 'csv'
+        write = {'parquet': self.write_parquet, 'csv': self.write_csv, 'jsonl': self.write_jsonl}[format]
+        filenames = []
+        for dataset, columns in DATASETS.items():
+            filename = Path(output_dir) / f'{prefix}-{dataset}.{format}'
+            write(filename, columns, getattr(self, f'{dataset}_rows')())
+            filenames.append(filename)
+        return filenames
+
+    ## Rows of the datasets, yielded one by one
+    def elements_rows(self):
+        for elt in self.model.get_elt_values():
+            yield (elt.leanix_id, elt.leanix_type, elt.leanix_name, elt.doc)
+
+    def relationships_rows(self):
+        for rel in self.model.get_rel_values():
+            yield (rel.leanix_id, rel.type, rel.leanix_name, rel.doc, rel.leanix_source, rel.leanix_target)
+
+    def tags_rows(self):
+        # Long format : one row per tag of an item
+        tag_names = self.model.tag_names
+        for kind, items in (('element', self.model.get_elt_values()),
+                            ('relationship', self.model.get_rel_values())):
+            for item in items:
+                for tag, value in item.tags.items():
+                    yield (item.leanix_id, kind, tag_names[tag], value)
+
+    def warnings_rows(self):
+        for warning in self.model.warnings_collection:
+            yield tuple(warning[:3])
+
+    ## Writers
+    def write_parquet(self, filename, columns, rows):
+        schema = pyarrow.schema([(name, pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+                                  if dictionary else pyarrow.string())
+                                 for name, dictionary in columns])
+        with pyarrow.parquet.ParquetWriter(filename, schema,
+                                           use_dictionary=[name for name, dictionary in columns if dictionary],
+                                           compression='zstd') as writer:
+            for chunk in chunks(rows):
+                values = list(zip(*chunk))
+                writer.write_batch(pyarrow.record_batch(
+                    [pyarrow.array(column, type=field.type) for column, field in zip(values, schema)],
+                    schema=schema))
+
+    def write_csv(self, filename, columns, rows):
+        with open(filename, 'w', encoding='utf-8', newline='') as output:
+            writer = csv.writer(output)
+            writer.writerow([name for name, dictionary in columns])
+            for chunk in chunks(rows):
+                writer.writerows(chunk)
+
+    def write_jsonl(self, filename, columns, rows):
+        names = [name for name, dictionary in columns]
+        with open(filename, 'w', encoding='utf-8') as output:
+            for chunk in chunks(rows):
+                output.writelines(json.dumps(dict(zip(names, row)), ensure_ascii=False) + '\n'
+                                  for row in chunk)
@@ -7,9 +7,7 @@
    - Export Excel Files
 '''
 
-import pandas as pd
-import xlsxwriter
-from leanIXConverterModels import Model, Writer
+from leanIXConverterModels import Model, Writer, write_xlsx
 from customLog import get_default_logger
 
 __author__ = "Serge LASSABE"
@@ -24,43 +22,27 @@ ELT_SHEET_NAME = 'Element'
 REL_SHEET_NAME = 'Relationship'
 
 class ExcelWriter(Writer):
-    def dump(self, filename):
-        writer = pd.ExcelWriter(filename, engine='xlsxwriter')
-        df = pd.DataFrame(ExcelElement(self.model).to_data_collection())
-        df.columns = ELT_COLUMNS
-        if False:   # Filter Application only
-            is_application = df['type'] == 'Application'
-            extract_df = df[is_application]
-        else:
-            extract_df = df
-        extract_df.to_excel(writer, index=False, header = True, sheet_name=ELT_SHEET_NAME)
-
-        df = pd.DataFrame(ExcelRelationship(self.model).to_data_collection())
-        df.columns = REL_COLUMNS_LONG
-        if False:   # Filter Application only
-            is_flow = df['type'] == 'Flow'
-            extract_df = df[is_flow]
-        else:
-            extract_df = df
-        extract_df.to_excel(writer, index=False, header = True, sheet_name=REL_SHEET_NAME)
-        writer.close()
+    def dump(self, filename, compression=None):
+        # Rows are streamed to the workbook (xlsxwriter constant memory mode)
+        # compression : gzip, zstd or zip - return the written file
+        return write_xlsx(filename, [(ELT_SHEET_NAME, ELT_COLUMNS,
+                                      ExcelElement(self.model).to_data_collection()),
+                                     (REL_SHEET_NAME, REL_COLUMNS_LONG,
+                                      ExcelRelationship(self.model).to_data_collection())],
+                          compression)
 
 class ExcelElement(ExcelWriter):
     def to_data_collection(self):
-        data_collection = []
+        # Rows are yielded one by one
         for elt in self.model.get_elt_values():
-            row = [elt.leanix_id, elt.leanix_type, elt.leanix_name, elt.doc]
-            data_collection.append(row)
-        return data_collection
+            yield [elt.leanix_id, elt.leanix_type, elt.leanix_name, elt.doc]
 
 class ExcelRelationship(ExcelWriter):
     def to_data_collection(self):
-        data_collection = []
+        # Rows are yielded one by one, an end out of the model has no name
+        names = {id: elt.leanix_name for id, elt in self.model.elt_dict.items()}
         for rel in self.model.get_rel_values():
             src_id = rel.leanix_source
-            src_name = self.model.get_elt(src_id).leanix_name
             target_id = rel.leanix_target
-            target_name = self.model.get_elt(target_id).leanix_name
-            row = [rel.leanix_id, rel.type, rel.leanix_name, rel.doc, src_id, src_name, target_id, target_name]
-            data_collection.append(row)
-        return data_collection
+            yield [rel.leanix_id, rel.type, rel.leanix_name, rel.doc,
+                   src_id, names.get(src_id), target_id, names.get(target_id)]
@@ -8,6 +8,7 @@
 '''
 
 import logging
+import logging.handlers
 import os
 
 from pathlib import Path
@@ -68,5 +69,19 @@ def init_log(module_name, log_name, debug=False):
     _DEFAULT_LOG = logger
     return logger
 
+def init_queue_log(module_name, queue, level=logging.INFO):
+    ''' Initiate the logger of a worker process
+
+    :param queue:   records are sent to queue, the parent process writes them
+                    with the handlers of its own logger (logging.handlers.QueueListener)
+    :return: the logger newly created
+    '''
+    global _DEFAULT_LOG
+    logger = logging.getLogger(module_name)
+    logger.handlers = [logging.handlers.QueueHandler(queue)]
+    logger.setLevel(level)
+    _DEFAULT_LOG = logger
+    return logger
+
 def get_default_logger():
     return _DEFAULT_LOG
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ Purpose :
+   Dump LeanIx and convert output in various file format
+   - HTTP transport : keep-alive connection pool, bounded retries with backoff
+'''
+
+import random
+import threading
+import time
+import datetime
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from customLog import get_default_logger
+
+__author__ = "Serge LASSABE"
+__copyright__ = "Copyright (C) 2023, Serge LASSABE"
+__license__ = "agpl-3.0"
+__version__ = "5.0.1"
+
+# HTTP status worth a new attempt : throttling and transient server errors
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class HostBudget():
+    ''' Requests a host may receive : at most concurrency at once, at most rate per second
+
+    Shared by every reader of the host (several workspaces in batch mode).
+    None or 0 : no limit.
+    '''
+
+    def __init__(self, concurrency=None, rate=None):
+        self.slots = threading.BoundedSemaphore(concurrency) if concurrency else None
+        self.interval = 1.0 / rate if rate else 0.0
+        self.lock = threading.Lock()
+        self.next_start = 0.0
+
+    @contextmanager
+    def acquire(self):
+        if self.slots:
+            self.slots.acquire()
+        try:
+            if self.interval:
+                # Requests are spaced by interval, in the order they asked
+                with self.lock:
+                    now = time.monotonic()
+                    start = max(now, self.next_start)
+                    self.next_start = start + self.interval
+                if start > now:
+                    time.sleep(start - now)
+            yield
+        finally:
+            if self.slots:
+                self.slots.release()
+
+
+class Transport():
+    ''' Shared HTTP layer used by every LeanIX call
+
+    - one requests.Session, so TLS connections are kept alive and reused
+    - bounded retries on connection errors, 429 and 5xx
+    - exponential backoff with full jitter, overridden by a Retry-After header
+    - with a credential (leanixAuthor.CredentialManager), the bearer token is
+      set on each attempt, and refreshed then retried once on 401
+    - with metrics (runMetrics.RunMetrics), each request is recorded under its
+      query kind : latency (retries included), bytes, retries, failure
+    - each attempt is counted in the budget of its host (set_host_budget),
+      backoff delays are not
+    '''
+
+    def __init__(self, pool_size=10, max_retries=5, backoff_factor=0.5, backoff_max=60.0, timeout=(10, 300)):
+        self.logger = get_default_logger()
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.session = requests.Session()
+        self.mount(pool_size)
+        self.host_concurrency = None
+        self.host_rate = None
+        self.budgets = {}   # {host: HostBudget}
+        self.budgets_lock = threading.Lock()
+
+    def mount(self, pool_size):
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def set_host_budget(self, concurrency=None, rate=None):
+        ''' Limit the requests in flight and per second of each host (None or 0 : no limit) '''
+        with self.budgets_lock:
+            self.host_concurrency = concurrency
+            self.host_rate = rate
+            self.budgets = {}
+        if concurrency and concurrency > self.pool_size:
+            # A connection kept alive for each request in flight
+            self.pool_size = concurrency
+            self.mount(concurrency)
+
+    def budget(self, url):
+        host = urlsplit(url).netloc
+        with self.budgets_lock:
+            budget = self.budgets.get(host)
+            if budget is None:
+                budget = self.budgets[host] = HostBudget(self.host_concurrency, self.host_rate)
+            return budget
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def request(self, method, url, credential=None, metrics=None, kind=None, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        headers = dict(kwargs.pop('headers', None) or {})
+        access_token = None
+        refreshed = False
+        attempt = 0
+        budget = self.budget(url)
+        start = time.perf_counter()
+        while True:
+            if credential:
+                access_token = credential.get_token()
+                headers['Authorization'] = f'Bearer {access_token}'
+            try:
+                with budget.acquire():
+                    resp = self.session.request(method, url, headers=headers, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                if attempt >= self.max_retries:
+                    if metrics:
+                        metrics.record_request(kind or method, time.perf_counter() - start, 0, attempt, failed=True)
+                    raise
+                delay = self.backoff(attempt)
+                self.logger.warning(
+                    f'{method} {url} : {exc.__class__.__name__} - retry {attempt + 1}/{self.max_retries} in {delay:.1f}s')
+            else:
+                if credential and resp.status_code == 401 and not refreshed:
+                    # Expired or revoked token : a new one, at once
+                    self.logger.warning(f'{method} {url} : status 401 - refreshing the access token')
+                    resp.close()
+                    credential.refresh(access_token)
+                    refreshed = True
+                    continue
+                if resp.status_code not in RETRY_STATUS or attempt >= self.max_retries:
+                    if metrics:
+                        metrics.record_request(kind or method, time.perf_counter() - start, len(resp.content),
+                                               attempt, failed=not resp.ok)
+                    return resp
+                delay = self.retry_after(resp)
+                if delay is None:
+                    delay = self.backoff(attempt)
+                self.logger.warning(
+                    f'{method} {url} : status {resp.status_code} - retry {attempt + 1}/{self.max_retries} in {delay:.1f}s')
+                resp.close()
+            attempt += 1
+            time.sleep(delay)
+
+    def backoff(self, attempt):
+        # Exponential backoff with full jitter
+        return random.uniform(0, min(self.backoff_max, self.backoff_factor * (2 ** attempt)))
+
+    def retry_after(self, resp):
+        # Retry-After is either a number of seconds or an HTTP date
+        value = resp.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            delay = float(value)
+        except ValueError:
+            try:
+                when = parsedate_to_datetime(value)
+            except (TypeError, ValueError):
+                return None
+            if when.tzinfo is None:
+                when = when.replace(tzinfo=datetime.timezone.utc)
+            delay = (when - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+        return min(self.backoff_max, max(0.0, delay))
+
+
+def base_url(base):
+    ''' URL of a LeanIX base : https, unless the base has its own scheme (a local stand-in) '''
+    return base if '://' in base else f'https://{base}'
+
+
+_DEFAULT_TRANSPORT = None
+_DEFAULT_TRANSPORT_LOCK = threading.Lock()
+
+
+def get_default_transport():
+    ''' Return the process wide transport, created on first use '''
+    global _DEFAULT_TRANSPORT
+    with _DEFAULT_TRANSPORT_LOCK:
+        if _DEFAULT_TRANSPORT is None:
+            _DEFAULT_TRANSPORT = Transport()
+        return _DEFAULT_TRANSPORT
@@ -7,8 +7,16 @@
    - Main module
 '''
 
+import datetime
 import re
-import pandas as pd
+import sys
+import functools
+import hashlib
+import threading
+from itertools import chain
+from types import MappingProxyType
+import xlsxwriter
+from outputCompression import open_compressed, compressed_name
 from customLog import get_default_logger
 
 __author__ = "Serge LASSABE"
@@ -18,64 +26,376 @@ __version__ = "5.0.1"
 
 Verbose = False
 
+DIGEST_MODULO = 1 << 128    # Item digests are 128 bits, summed per type
+NO_TAGS = MappingProxyType({})  # Shared by the items without tags
+# Header format of the xlsx sheets (the one pandas used to write)
+XLSX_HEADER_FORMAT = {'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'}
+# Creation date of the xlsx files, the date of the zip entries
+XLSX_CREATED = datetime.datetime(1980, 1, 1)
+FLOW_NAME = re.compile(r'^.*? \((.*?) *- *(.*)\)$', re.DOTALL)
+
+
+def write_xlsx(filename, sheets, compression=None):
+    ''' Write sheets [(sheet name, columns, rows)] row by row, rows are never held in memory
+
+    compression : gzip, zstd or zip, the workbook is compressed on the fly
+    Return the written file (filename with the compression suffix)
+    '''
+    if compression:
+        # Written through a stream that cannot be rewound
+        with open_compressed(filename, compression, seekable=False) as output:
+            write_workbook(output, sheets)
+    else:
+        write_workbook(filename, sheets)
+    return compressed_name(filename, compression)
+
+
+def write_workbook(output, sheets):
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    # Fixed creation date : the same data gives the same file (unchanged files are not uploaded)
+    workbook.set_properties({'created': XLSX_CREATED})
+    header_format = workbook.add_format(XLSX_HEADER_FORMAT)
+    for sheet_name, columns, rows in sheets:
+        sheet = workbook.add_worksheet(sheet_name)
+        sheet.write_row(0, 0, columns, header_format)
+        for row_number, row in enumerate(rows, 1):
+            sheet.write_row(row_number, 0, row)
+    workbook.close()
+
+
+@functools.lru_cache(maxsize=65536)
+def parse_interface_name(text):
+    ''' Split an interface name "<label> (<provider> - <consumer>)"
+
+    Return (label, provider, consumer, well_formed) : the label is the name
+    without the parenthesis, provider and consumer are None when not found.
+    A name is well formed when it has a parenthesis.
+    '''
+    if not text:
+        return '', None, None, True
+    name_fields = text.split(' (', 2)
+    if len(name_fields) == 1:
+        return text, None, None, False
+    ends = FLOW_NAME.match(text)
+    if ends:
+        return name_fields[0], ends.group(1), ends.group(2), True
+    return name_fields[0], None, None, True
+
+
 class Model():
     def __init__(self):
         self.logger = get_default_logger()
-        self.warnings_collection = []
+        self.warnings_collection = []   # [type, label, context, [origin factSheetIds]]
+        self.malformed_names = {}       # {context: warning} interface names already warned (1)
         self.elt_dict = {}      # {id1: Element1}
         self.rel_dict = {}      # {id1: Relationship1}
         self.tag_incr = 0
         self.tags_refs = {}     # {"tagName": "tagRef"}
-        # Used in DrawioWriter(Writer) class
-        self.refer_ids_to = {}  # {id_from1: [id_to1 id_to2]}
-        self.refer_ids_from = {}# {id_to1: [id_from1 id_from2]}
+        self.tag_names = []     # ["tagName"] items tags are keyed by the index of their name
+        self.tag_index = {}     # {"tagName": index}
+        self.lock = threading.Lock()    # Readers may populate the model concurrently
+        self.origins = {}       # {factSheetId: ([elt id1], [rel id1])} items built from a fact sheet
+        self.digests = {}       # {"E:type" | "R:type": [sum of item digests, count]}
+        # Indexes, maintained as items are added and removed
+        self.elts_by_type = {}  # {type: {id1: Element1}}
+        self.rels_by_type = {}  # {type: {id1: Relationship1}}
+        self.rels_from = {}     # {source id: {id1: Relationship1}}
+        self.rels_to = {}       # {target id: {id1: Relationship1}}
+
+    ##
+    # Content checksum :
+    #   - each item has a digest of its content (id, names, doc, ends, tags)
+    #   - item digests are summed by item type, so a type digest is updated
+    #     as items are created, modified or removed, whatever the order
+    #   - the model checksum is the digest of the type digests
+    ##
+    def add_elt(self, elt, origin):
+        with self.lock:
+            previous = self.elt_dict.get(elt.leanix_id)
+            if previous:
+                self.update_digest(previous.digest_group(), -previous.digest, -1)
+                self.unindex_elt(previous)
+            self.index_elt(elt)
+            self.update_digest(elt.digest_group(), elt.digest, 1)
+            self.add_origin(origin, 'E', elt.leanix_id)
+
+    def add_rel(self, rel, origin):
+        with self.lock:
+            previous = self.rel_dict.get(rel.leanix_id)
+            if previous:
+                self.update_digest(previous.digest_group(), -previous.digest, -1)
+                self.unindex_rel(previous)
+            self.index_rel(rel)
+            self.update_digest(rel.digest_group(), rel.digest, 1)
+            self.add_origin(origin, 'R', rel.leanix_id)
+
+    def update_digest(self, group, digest, count):
+        # Called with the lock held
+        type_digest = self.digests.setdefault(group, [0, 0])
+        type_digest[0] = (type_digest[0] + digest) % DIGEST_MODULO
+        type_digest[1] += count
+
+    def get_type_digests(self):
+        return {group: f'{digest:032x}-{count}'
+                for group, (digest, count) in sorted(self.digests.items()) if count}
 
     def get_checksum(self):
-        return "E{}-R{}-P{}".format(len(self.get_elt_values()), len(self.get_rel_values()), len(self.get_rel_values()))
+        content = '\n'.join(f'{group}:{digest}'
+                            for group, digest in self.get_type_digests().items())
+        return hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+
+    def get_digests(self):
+        ''' Digests to keep until the next run : {'types': {group: digest}, 'items': {group: {id: digest}}} '''
+        items = {}
+        for item in chain(self.elt_dict.values(), self.rel_dict.values()):
+            items.setdefault(item.digest_group(), {})[item.leanix_id] = f'{item.digest:032x}'[:16]
+        return {'types': self.get_type_digests(), 'items': items}
+
+    def diff_digests(self, previous):
+        ''' Compare with the digests of a previous run
+
+        Only the item types whose digest changed are compared item by item.
+        Return {group: {'added': [ids], 'removed': [ids], 'modified': [ids]}}
+        '''
+        previous_types = previous.get('types', {})
+        current_types = self.get_type_digests()
+        changed_groups = [group for group in set(previous_types) | set(current_types)
+                          if previous_types.get(group) != current_types.get(group)]
+        result = {}
+        for group in sorted(changed_groups):
+            kind, type = group.split(':', 1)
+            items = self.elts_by_type if kind == 'E' else self.rels_by_type
+            current = {id: f'{item.digest:032x}'[:16] for id, item in items.get(type, {}).items()}
+            before = previous.get('items', {}).get(group, {})
+            result[group] = {'added': sorted(set(current) - set(before)),
+                             'removed': sorted(set(before) - set(current)),
+                             'modified': sorted(id for id in set(current) & set(before)
+                                                if current[id] != before[id])}
+        return result
+
+    ##
+    # Indexes : called with the lock held
+    ##
+    def index_elt(self, elt):
+        self.elt_dict[elt.leanix_id] = elt
+        self.elts_by_type.setdefault(elt.leanix_type, {})[elt.leanix_id] = elt
+
+    def unindex_elt(self, elt):
+        del self.elt_dict[elt.leanix_id]
+        self.unindex(self.elts_by_type, elt.leanix_type, elt.leanix_id)
+
+    def index_rel(self, rel):
+        id = rel.leanix_id
+        self.rel_dict[id] = rel
+        self.rels_by_type.setdefault(rel.type, {})[id] = rel
+        self.rels_from.setdefault(rel.leanix_source, {})[id] = rel
+        self.rels_to.setdefault(rel.leanix_target, {})[id] = rel
+
+    def unindex_rel(self, rel):
+        id = rel.leanix_id
+        del self.rel_dict[id]
+        self.unindex(self.rels_by_type, rel.type, id)
+        self.unindex(self.rels_from, rel.leanix_source, id)
+        self.unindex(self.rels_to, rel.leanix_target, id)
+
+    def unindex(self, index, key, id):
+        items = index[key]
+        del items[id]
+        if not items:
+            del index[key]
+
+    ##
+    # Accessors : the values are views on the model, not copies,
+    # they must not be iterated while the model is modified
+    ##
     def get_elt_keys(self):
-        return list(self.elt_dict.keys())
+        return self.elt_dict.keys()
     def get_elt_values(self):
-        return list(self.elt_dict.values())
+        return self.elt_dict.values()
+    def get_elts_by_type(self, type):
+        return self.elts_by_type.get(type, {}).values()
     def get_elt(self, id):
         if Verbose and not(self.elt_dict.get(id)):
             self.logger.error(f'>> get_elt: no element found for {id}')
         return self.elt_dict.get(id)
     def get_rel_keys(self):
-        return list(self.rel_dict.keys())
+        return self.rel_dict.keys()
     def get_rel_values(self):
-        return list(self.rel_dict.values())
+        return self.rel_dict.values()
+    def get_rels_by_type(self, type):
+        return self.rels_by_type.get(type, {}).values()
+    def get_rels_from(self, id):
+        # Relationships whose source is the item id
+        return self.rels_from.get(id, {}).values()
+    def get_rels_to(self, id):
+        # Relationships whose target is the item id
+        return self.rels_to.get(id, {}).values()
     def get_rel(self, id):
         if Verbose and not(self.elt_dict.get(id)):
             self.logger.error(f'>> get_rel: no element found for {id}')
         return self.rel_dict.get(id)
 
+    def get_elt_counts(self):
+        return {type: len(elts) for type, elts in self.elts_by_type.items()}
+
+    def get_rel_counts(self):
+        return {type: len(rels) for type, rels in self.rels_by_type.items()}
+
     def get_statistics(self):
-        # Count elements
-        elt_count_by_type = {}
-        for elt in self.get_elt_values():
-            previous_count = elt_count_by_type.get(elt.leanix_type)
-            if previous_count:
-                count = previous_count + 1
-            else:
-                count = 1
-            elt_count_by_type[elt.leanix_type] = count
-        # Count relationships
-        rel_count_by_type = {}
-        for rel in self.get_rel_values():
-            previous_count = rel_count_by_type.get(rel.type)
-            if previous_count:
-                count = previous_count + 1
-            else:
-                count = 1
-            rel_count_by_type[rel.type] = count
-
-        return f'Statistics:\n- elements : {elt_count_by_type}\n- relations : {rel_count_by_type})'
-
-    # Get and set refers as id
+        return f'Statistics:\n- elements : {self.get_elt_counts()}\n- relations : {self.get_rel_counts()})'
+
+    def project(self, elt_types, rel_types, dropped_tags=()):
+        ''' Return a new model restricted to some types, without extracting it again
+
+        Relationships are kept when neither end is an element of another type.
+        Warnings are copied : they are about the interfaces and flows.
+        '''
+        model = Model()
+        with model.lock:
+            # Tags are registered in the same order, without the dropped ones
+            tag_map = {index: model.tag_key(name) for index, name in enumerate(self.tag_names)
+                       if name not in dropped_tags}
+            for type in elt_types:
+                for elt in self.get_elts_by_type(type):
+                    item = elt.projected(model, tag_map)
+                    model.index_elt(item)
+                    model.update_digest(item.digest_group(), item.digest, 1)
+            for type in rel_types:
+                for rel in self.get_rels_by_type(type):
+                    source = self.elt_dict.get(rel.leanix_source)
+                    target = self.elt_dict.get(rel.leanix_target)
+                    if (source and source.leanix_type not in elt_types) or \
+                            (target and target.leanix_type not in elt_types):
+                        continue
+                    item = rel.projected(model, tag_map)
+                    model.index_rel(item)
+                    model.update_digest(item.digest_group(), item.digest, 1)
+            for origin, (elt_ids, rel_ids) in self.origins.items():
+                elt_ids = [id for id in elt_ids if id in model.elt_dict]
+                rel_ids = [id for id in rel_ids if id in model.rel_dict]
+                if elt_ids or rel_ids:
+                    model.origins[origin] = (elt_ids, rel_ids)
+        model.warnings_collection = [[type, label, ctxt, list(origins)]
+                                     for type, label, ctxt, origins in self.warnings_collection]
+        model.reset_malformed_names()
+        return model
+
+    def sort_items(self):
+        ''' Order the items by type and id, the tags by name, the warnings by type and context
+
+        Readers populate the model concurrently : items and tags are registered
+        in whatever order the threads reach the model. Once sorted, the same
+        content is written with the same bytes (tag references included).
+        Digests are unchanged : tags are digested by name.
+        '''
+        with self.lock:
+            tag_names = self.tag_names
+            self.tag_incr = 0
+            self.tags_refs = {}
+            self.tag_names = []
+            self.tag_index = {}
+            tag_map = {index: self.tag_key(name) for index, name in
+                       sorted(enumerate(tag_names), key=lambda tag: tag[1])}
+            elts = sorted(self.elt_dict.values(), key=lambda elt: (elt.leanix_type, elt.leanix_id))
+            rels = sorted(self.rel_dict.values(), key=lambda rel: (rel.type, rel.leanix_id))
+            self.elt_dict, self.elts_by_type = {}, {}
+            self.rel_dict, self.rels_by_type, self.rels_from, self.rels_to = {}, {}, {}, {}
+            for elt in elts:
+                elt.sort_tags(tag_map)
+                self.index_elt(elt)
+            for rel in rels:
+                rel.sort_tags(tag_map)
+                self.index_rel(rel)
+            # An incremental update adds its warnings last
+            self.warnings_collection.sort(key=lambda warning: (warning[0], warning[2]))
+
+    def tag_key(self, name):
+        # Called with the lock held
+        index = self.tag_index.get(name)
+        if index is None:
+            name = sys.intern(name)
+            index = self.tag_incr
+            self.tag_names.append(name)
+            self.tag_index[name] = index
+            self.tags_refs[name] = f'tag-property-ref{index}'
+            self.tag_incr += 1
+        return index
+
+    def add_origin(self, origin, kind, id):
+        # Called with the lock held, an item built twice is listed twice
+        items = self.origins.get(origin)
+        if items is None:
+            items = self.origins[origin] = ([], [])
+        items[0 if kind == 'E' else 1].append(id)
+
+    def linked_interfaces(self, ids):
+        ''' The interface fact sheets built with the elements ids (their applications)
+
+        Interface elements are named after their provider, and an interface
+        loses an end with an archived application.
+        '''
+        rel_origins = {rel_id: origin for origin, (_, rel_ids) in self.origins.items()
+                       for rel_id in rel_ids}
+        interfaces = set()
+        for id in ids:
+            for rel in chain(self.get_rels_from(id), self.get_rels_to(id)):
+                other = self.elt_dict.get(rel.leanix_target if rel.leanix_source == id else rel.leanix_source)
+                if rel.type == 'Flow' or (other and other.leanix_type == 'Interface'):
+                    origin = rel_origins.get(rel.leanix_id)
+                    if origin and origin != id:
+                        interfaces.add(origin)
+        return sorted(interfaces)
+
+    def remove_fact_sheets(self, fact_sheets):
+        ''' Remove what was built from some fact sheets before extracting them again
+
+        fact_sheets : {factSheetId: active}, relations to fact sheets no more active
+        are removed too, as well as the warnings raised only by the fact sheets
+        '''
+        gone = set()
+        for fact_sheet_id, active in fact_sheets.items():
+            elt_ids, rel_ids = self.origins.pop(fact_sheet_id, ((), ()))
+            for id in elt_ids:
+                self.remove_item(self.elt_dict, id)
+            for id in rel_ids:
+                self.remove_item(self.rel_dict, id)
+            if not active:
+                gone.add(fact_sheet_id)
+        for id in gone:
+            for rel in list(chain(self.get_rels_from(id), self.get_rels_to(id))):
+                self.remove_item(self.rel_dict, rel.leanix_id)
+        warnings = []
+        for warning in self.warnings_collection:
+            # A warning without origin (5) is built again by validate_flows
+            origins = [id for id in warning[3] if id not in fact_sheets]
+            if origins or not warning[3]:
+                warning[3] = origins
+                warnings.append(warning)
+        self.warnings_collection = warnings
+        self.reset_malformed_names()
+
+    def remove_item(self, items, id):
+        with self.lock:
+            item = items.get(id)
+            if item:
+                self.update_digest(item.digest_group(), -item.digest, -1)
+                if items is self.elt_dict:
+                    self.unindex_elt(item)
+                else:
+                    self.unindex_rel(item)
+
+    # Get refers as id : the flows of an application, the applications of a flow
+    # (formerly maintained for the drawio writer, now read from the indexes)
     def get_refer_ids_to(self, k):
-        return self.refer_ids_to.setdefault(k, [])
+        flow = self.rel_dict.get(k)
+        if flow and flow.type == 'Flow':
+            return [flow.leanix_target]
+        return [rel.leanix_id for rel in self.get_rels_from(k) if rel.type == 'Flow']
     def get_refer_ids_from(self, k):
-        return self.refer_ids_from.setdefault(k, [])
+        flow = self.rel_dict.get(k)
+        if flow and flow.type == 'Flow':
+            return [flow.leanix_source]
+        return [rel.leanix_id for rel in self.get_rels_to(k) if rel.type == 'Flow']
 
     # Convenient methods
     def dump(self):
@@ -91,100 +411,212 @@ class Model():
                       3: 'Absence de Producteur et Consommateur pour cette interface (suppression)',
                       4: 'Absence de Consommateur pour cette interface',
                       5: "Libellé d'interface contraire aux conventions de nommage (incohérence sur la source et/ou destination)"}
-    def warning(self, type, ctxt, where):
-        self.warnings_collection.append([f'WARNING({type})', self.WARNING_LABELS[type], ctxt])
-        return
+    def warning(self, type, ctxt, where, origin=None):
+        # origin : the fact sheet the warning is about, removed with it (see remove_fact_sheets)
+        warning = [f'WARNING({type})', self.WARNING_LABELS[type], ctxt, [origin] if origin else []]
+        self.warnings_collection.append(warning)
+        return warning
 
-    def dump_warning(self, filename):
-        writer = pd.ExcelWriter(filename, engine='xlsxwriter')
-        df = pd.DataFrame(self.warnings_collection)
-        df.columns = ['Type de Warning', 'Description du Warning', 'Contexte']
-        df.to_excel(writer, index=False, header = True, sheet_name='Warning liste')
-        writer.close()
-        return
+    def dump_warning(self, filename, compression=None):
+        return write_xlsx(filename, [('Warning liste',
+                                      ['Type de Warning', 'Description du Warning', 'Contexte'],
+                                      (warning[:3] for warning in self.warnings_collection))],
+                          compression)
 
     def check_flow_name(self, name, id_provider, id_consumer):
-        name_provider = self.get_elt(id_provider).leanix_name
-        name_consumer = self.get_elt(id_consumer).leanix_name
-        check = re.search(f"^.*\({name_provider.upper()} *- *{name_consumer.upper()}\)$",name.upper())
-        if not check:
-            self.warning(5, f'Interface : "{name}" - Producteur : "{name_provider}" - Consommateur : "{name_consumer}"', 'check_flow_name')
-        return check
+        return FlowNameChecker(self).check(name, id_provider, id_consumer)
 
+    def validate_flows(self):
+        ''' Check the names of all the flows once extracted, return the number of invalid names
 
-    def interface_name_beautifier(self, text):
-        if not text:
-            return ''
-        else:
-            result = text
-            name_fields = text.split(' (', 2)
-            if len(name_fields) > 1:
-                result = name_fields[0]
-            else:
-                self.warning(1, f'"{text}"', 'interface_name_beautifier')
-            return result
-
-    # Used only for drawio, could be removed
-    def set_refers_ids_to(self, k, v):
-        return self.refer_ids_to.setdefault(k, []).append(v)
-    def set_refers_ids_from(self, k, v):
-        return self.refer_ids_from.setdefault(k, []).append(v)
+        Warnings 5 are built again, so the model can be validated after each update
+        '''
+        self.warnings_collection = [warning for warning in self.warnings_collection
+                                    if warning[0] != 'WARNING(5)']
+        checker = FlowNameChecker(self)
+        invalid = 0
+        for rel in self.get_rels_by_type('Flow'):
+            if not checker.check(rel.leanix_name, rel.leanix_source, rel.leanix_target):
+                invalid += 1
+        return invalid
+
+    def interface_name_beautifier(self, text, origin=None):
+        result, provider, consumer, well_formed = parse_interface_name(text)
+        if not well_formed:
+            # The same name is beautified several times : warn once, for every fact sheet named so
+            ctxt = f'"{text}"'
+            with self.lock:
+                warning = self.malformed_names.get(ctxt)
+                if warning is None:
+                    self.malformed_names[ctxt] = self.warning(1, ctxt, 'interface_name_beautifier', origin)
+                elif origin and origin not in warning[3]:
+                    warning[3].append(origin)
+        return result
+
+    def reset_malformed_names(self):
+        # To call when warnings are filtered or loaded
+        self.malformed_names = {warning[2]: warning for warning in self.warnings_collection
+                                if warning[0] == 'WARNING(1)'}
 
     def get_projects(self):
         result = []
-        for elt in self.get_elt_values():
-            if elt.leanix_type == 'Project':
-                self.logger.debug (f'FOUND : {elt.leanix_name}')
-                result.append(elt.leanix_name)
+        for elt in self.get_elts_by_type('Project'):
+            self.logger.debug (f'FOUND : {elt.leanix_name}')
+            result.append(elt.leanix_name)
         return result
 
 class ModelItems():
+    # Hundreds of thousands of items : no instance dict, ids are interned
+    # and tags are keyed by the index of their name in model.tag_names
+    __slots__ = ('tags', 'digest')
+
     def __init__(self):
-        self.logger = get_default_logger()
-        self.tags = {}
+        self.tags = NO_TAGS     # {tag index: value}
+        self.digest = 0
 
     def set_tags(self, model, k, v):
-        self.tags[k] = v
-        if not model.tags_refs.get(k):
-            model.tags_refs[k] = f'tag-property-ref{model.tag_incr}'
-            model.tag_incr += 1
+        with model.lock:
+            if self.tags is NO_TAGS:
+                self.tags = {}
+            self.tags[model.tag_key(k)] = v
+            # Keep the type digest up to date
+            previous = self.digest
+            self.digest = self.compute_digest(model)
+            model.update_digest(self.digest_group(), self.digest - previous, 0)
+
+    def projected(self, model, tag_map):
+        ''' Copy of the item for a projected model
+
+        tag_map : {tag index: tag index in model}, the other tags are dropped
+        '''
+        item = object.__new__(type(self))
+        for cls in type(self).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                setattr(item, name, getattr(self, name))
+        if self.tags:
+            item.tags = {tag_map[k]: v for k, v in self.tags.items() if k in tag_map} or NO_TAGS
+            if len(item.tags) != len(self.tags):
+                item.digest = item.compute_digest(model)
+        return item
+
+    def sort_tags(self, tag_map):
+        # tag_map : {tag index: new tag index}, the tags are kept in the new index order
+        if self.tags:
+            self.tags = dict(sorted((tag_map[k], v) for k, v in self.tags.items()))
+
+    def digest_fields(self):
+        return ()
+
+    def digest_group(self):
+        return ''
+
+    def compute_digest(self, model):
+        # Tags are digested by name, digests do not depend on the tag indexes
+        fields = '\x1f'.join('\x00' if field is None else str(field)
+                             for field in self.digest_fields())
+        tags = '\x1f'.join(f'{k}\x1e{v}' for k, v in sorted(self.get_tags(model).items()))
+        content = f'{fields}\x1d{tags}'.encode('utf-8')
+        return int.from_bytes(hashlib.blake2b(content, digest_size=16).digest(), 'big')
 
-    def get_tags(self):
-        return self.tags
+    def get_tags(self, model):
+        ''' Return the tags keyed by name : {"tagName": value} '''
+        tag_names = model.tag_names
+        return {tag_names[k]: v for k, v in self.tags.items()}
 
 class Element(ModelItems):
-    def __init__(self, model, id, type, name, descr):
+    __slots__ = ('leanix_id', 'leanix_type', 'leanix_name', 'doc')
+
+    def __init__(self, model, id, type, name, descr, origin=None):
+        # origin : the fact sheet the element is built from, itself by default
         super().__init__()
-        self.leanix_id = id
-        self.leanix_type = type
+        self.leanix_id = sys.intern(id)
+        self.leanix_type = sys.intern(type)
         self.leanix_name = name
         self.doc = descr
-        model.elt_dict[id] = self
+        self.digest = self.compute_digest(model)
+        model.add_elt(self, origin or id)
+
+    def digest_fields(self):
+        return (self.leanix_id, self.leanix_type, self.leanix_name, self.doc)
+
+    def digest_group(self):
+        return f'E:{self.leanix_type}'
 
     def __str__(self):
         return f'Element(id = {self.leanix_id}, type = {self.leanix_type}, name = {self.leanix_name}, doc = ..., tags = {self.tags})'
 
 class Relationship(ModelItems):
-    def __init__(self, model, id, type, name, descr, src, target):
+    __slots__ = ('leanix_id', 'leanix_name', 'doc', 'type', 'leanix_source', 'leanix_target')
+
+    def __init__(self, model, id, type, name, descr, src, target, origin=None):
+        # origin : the fact sheet the relation is built from, its source by default
         super().__init__()
-        self.leanix_id = id
+        self.leanix_id = sys.intern(id)
         self.leanix_name = name # used only for Flow
         self.doc = descr        # used only for Flow
-        self.type = type
-        self.leanix_source = src
-        self.leanix_target = target
-        model.rel_dict[id] = self
-        # Used only for drawio, could be removed
-        if type == 'Flow':
-            model.set_refers_ids_to(src, id)
-            model.set_refers_ids_to(id, target)
-            model.set_refers_ids_from(target, id)
-            model.set_refers_ids_from(id, src)
+        self.type = sys.intern(type)
+        # Ends are ids of elements : share their strings
+        self.leanix_source = sys.intern(src) if src else src
+        self.leanix_target = sys.intern(target) if target else target
+        self.digest = self.compute_digest(model)
+        model.add_rel(self, origin or src)
+
+    def digest_fields(self):
+        return (self.leanix_id, self.type, self.leanix_name, self.doc, self.leanix_source, self.leanix_target)
+
+    def digest_group(self):
+        return f'R:{self.type}'
 
     def __str__(self):
         return f'Relationship(id = {self.leanix_id}, type = {self.type}, name = {self.leanix_name}, src = {self.leanix_source}, target = {self.leanix_target}, doc = ..., tags = {self.tags})'
 
 
+class FlowNameChecker():
+    ''' Check that a flow is named "... (<PROVIDER> - <CONSUMER>)" after its applications
+
+    Application names are normalized once. The ends parsed from the flow name
+    (parse_interface_name, already cached by the extraction) are compared first,
+    a matcher is compiled once per (provider, consumer) pair for the names the
+    parsing splits elsewhere (an application named "... - ..." or "... (...)").
+    '''
+    def __init__(self, model):
+        self.model = model
+        self.names = {}     # {id: (name, upper name)}, name is None for unknown elements
+        self.matchers = {}  # {(id_provider, id_consumer): compiled regex}
+
+    def name(self, id):
+        names = self.names.get(id)
+        if names is None:
+            elt = self.model.get_elt(id)
+            name = elt.leanix_name if elt else None
+            names = self.names[id] = (name, (name or '').upper())
+        return names
+
+    def matcher(self, id_provider, id_consumer):
+        matcher = self.matchers.get((id_provider, id_consumer))
+        if matcher is None:
+            matcher = re.compile(f"^.*\\({re.escape(self.name(id_provider)[1])} *- *"
+                                 f"{re.escape(self.name(id_consumer)[1])}\\)$")
+            self.matchers[(id_provider, id_consumer)] = matcher
+        return matcher
+
+    def check(self, name, id_provider, id_consumer):
+        name_provider, upper_provider = self.name(id_provider)
+        name_consumer, upper_consumer = self.name(id_consumer)
+        # A flow to an element out of the model can not be checked
+        if name_provider is None or name_consumer is None:
+            check = False
+        else:
+            # The matcher does not cross an end of line, nor does the parsed ends check
+            _, provider, consumer, _ = parse_interface_name(name)
+            check = (provider is not None and '\n' not in name and provider.upper() == upper_provider
+                     and consumer.upper() == upper_consumer) or \
+                bool(self.matcher(id_provider, id_consumer).search((name or '').upper()))
+        if not check:
+            self.model.warning(5, f'Interface : "{name}" - Producteur : "{name_provider or id_provider}" - Consommateur : "{name_consumer or id_consumer}"', 'check_flow_name')
+        return check
+
+
 class Reader:
     def __init__ (self, model):
         self.logger = get_default_logger()
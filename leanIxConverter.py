@@ -7,40 +7,58 @@
    - Main module : manage readers and writers conversion modules
 '''
 
+import argparse
 import datetime
+import logging.handlers
+import multiprocessing
 import sys
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-import pysftp
 import requests
 
 from leanIXConverterModels import Model
 from connectorAPI import GraphQLReader
 from connectorArchi import XmlArchiWriter
 from connectorExcel import ExcelWriter
+from connectorColumnar import ColumnarWriter, FORMATS as COLUMNAR_FORMATS
+from responseCache import ResponseCache
+from sftpPublisher import SftpPublisher
+from outputCompression import COMPRESSIONS, resolve_compression
+from modelStore import save_model, load_model
 from releaseNotes import getNotes, getBanner
-from customLog import init_log
+from runMetrics import RunMetrics
+from runProfiler import Profiler
+from httpTransport import get_default_transport
+from customLog import init_log, init_queue_log
 
 __author__ = "Serge LASSABE"
 __copyright__ = "Copyright (C) 2023, Serge LASSABE"
 __license__ = "agpl-3.0"
 __version__ = "5.0.1"
 
+# Light model : the applications and their interfaces, projected from the full model if any
+LIGHT_ELEMENT_TYPES = ['Application', 'DataObject', 'Interface']
+LIGHT_RELATIONSHIP_TYPES = ['Composition', 'Flow', 'Serving']
+LIGHT_DROPPED_TAGS = ['LEANIX.DATA_OBJECT']
+
 '''
     Manage informations about conversion process :
     - check_if_changed : return the new 'model checksum' if changed from previous conversion process
     - write_last_conversion : serialize current conversion informations
     - read_last_conversion : deserialize previous conversion informations
-    'model checksum' is a basic digest from LeanIX content
+    'model checksum' is a digest of the LeanIX content, built from per type and per item digests
 '''
 
 
-def write_last_conversion(filename, checksum, when, version):
+def write_last_conversion(filename, checksum, when, version, digests=None):
     # Write a digest to check when a model is modified
+    # digests : per type and per item digests, to report what changed at next conversion
     with open(filename, 'w') as output:
         json.dump({'checksum': checksum, 'date': when,
-                  'version': version}, output)
+                  'version': version, 'digests': digests or {}}, output)
 
 
 def read_last_conversion(filename):
@@ -53,6 +71,13 @@ def read_last_conversion(filename):
     return data
 
 
+def leanix_date(updated_at):
+    # LeanIX date (ISO 8601, UTC) in the format of the run timestamp, None without any fact sheet
+    if not updated_at:
+        return None
+    return datetime.datetime.fromisoformat(updated_at.replace('Z', '+00:00')).strftime('%Y-%m-%d-%Hh%M')
+
+
 def check_if_changed(model, checksum_filename, ws, when, changelog_filename):
     checksum_new = model.get_checksum()
     last_convert = read_last_conversion(checksum_filename)
@@ -72,18 +97,27 @@ def check_if_changed(model, checksum_filename, ws, when, changelog_filename):
                     f"Info de génération : \nDate : {when} - Version : {__version__}\n")
         logger.info(
             f"Change detected since {date_previous} :\n- previous checksum : {checksum_previous} - new checksum : {checksum_new}\n- previous version : {version_previous} - new version : {__version__}")
+        if last_convert.get('digests'):
+            log_changes(model.diff_digests(last_convert['digests']))
         return checksum_new
 
 
+def log_changes(changes, max_ids=10):
+    for group, diff in changes.items():
+        summary = ' - '.join(f'{len(ids)} {what}' + (f' {ids[:max_ids]}' if ids else '')
+                             for what, ids in diff.items())
+        logger.info(f'{group} : {summary}')
+
+
 '''
     Publish message
 '''
 
 
-def inform(channel, title, message):
-    ''' Send status on ntfy.sh '''
-    url = 'https://ntfy.sh/' + channel
-    resp = requests.post('https://ntfy.sh/' + channel,
+def inform(channel, title, message, ntfy_url='https://ntfy.sh/'):
+    ''' Send status on ntfy.sh (or another ntfy server) '''
+    url = ntfy_url + channel
+    resp = requests.post(url,
                          data=message.encode(encoding='utf-8'),
                          headers={"Title": title})
     if resp.status_code != requests.codes.ok:
@@ -95,82 +129,382 @@ def inform(channel, title, message):
     return resp
 
 
-def launch_it(ws, leanix_url, leanix_token, sftp_srv, sftp_usr, sftp_pwd, ntfy_channel):
+def extract_model(ws, leanix_url, leanix_token, full_extract, cache, snapshot_filename, incremental=False,
+                  metrics=None, max_workers=4, page_size=100):
+    """ Extract a LeanIX workspace into a model
+
+    Args:
+        full_extract (bool): extract every fact sheet type, not only Application and Interface
+        snapshot_filename (Path): where the model is persisted at the end of the extraction
+        incremental (bool): update the model persisted by the previous run
+        metrics (RunMetrics): where requests and stages are recorded
+        max_workers (int): LeanIX queries run at once, 1 : sequential extraction
+        page_size (int): fact sheets per GraphQL page, the memory held by a query
+    Return the model and its watermark (most recent LeanIX update)
+    """
+    metrics = metrics or RunMetrics(ws)
+    model, watermark = None, None
+    if incremental:
+        with metrics.stage('snapshot:load'):
+            model, watermark = load_model(snapshot_filename)
+    if model and watermark:
+        # Only ask LeanIX for the fact sheets updated since the previous run
+        graphQL_reader = GraphQLReader(leanix_url, ws, leanix_token, model, max_workers=max_workers,
+                                       page_size=page_size, cache=cache, metrics=metrics)
+        graphQL_reader.populate_incremental(full_extract, watermark)
+    else:
+        graphQL_reader = GraphQLReader(leanix_url, ws, leanix_token, Model(), max_workers=max_workers,
+                                       page_size=page_size, cache=cache, metrics=metrics)
+        graphQL_reader.populate(full_extract)
+    with metrics.stage('snapshot:save'):
+        save_model(graphQL_reader.get_model(), snapshot_filename, graphQL_reader.watermark)
+    return graphQL_reader.get_model(), graphQL_reader.watermark
+
+
+def launch_it(ws, leanix_url, leanix_token, sftp_srv, sftp_usr, sftp_pwd, ntfy_channel,
+              replay=False, cache_ttl=0, cache_max_mb=1024, incremental=False, columnar=None,
+              ntfy_url='https://ntfy.sh/', profile=False, compression=None, compact_oef=False,
+              writer_pool=None, max_workers=4, page_size=100):
     """ Launch extract
 
     Args:
         ws (str): the LeanIx work space to extract
-        test_mode (bool): for debugging purpose
+        leanix_url (str): LeanIX host, https unless a scheme is given (e.g. http://localhost:8080)
+        sftp_srv (str): where to upload the files (host or host:port), no upload when empty
+        replay (bool): rebuild the model from cached LeanIX responses, without network
+        cache_ttl (int): reuse cached LeanIX responses younger than cache_ttl seconds (0 : record only)
+        cache_max_mb (int): size limit of the response cache
+        incremental (bool): update the model of the previous run with the fact sheets updated since
+        columnar (str): also export the model as parquet, csv or jsonl datasets (None : no export)
+        ntfy_url (str): ntfy server the status is sent to
+        profile (bool): profile each stage (cProfile, tracemalloc, sampled stacks) in log/
+        compression (str): gzip, zstd or zip : OEF and Excel files are compressed as they are written
+        compact_oef (bool): OEF files without indentation nor end of lines
+        writer_pool (ProcessPoolExecutor): where the files are written (CPU bound), in this process when None
+        max_workers (int): LeanIX queries run at once for the workspace, 1 : sequential extraction
+        page_size (int): fact sheets per GraphQL page
+    LeanIX requests by query kind, the duration of each stage and the model sizes
+    are written in log/run-report-<ws>.json and log/leanix-<ws>.prom (Prometheus)
     """
     when = datetime.datetime.now().strftime('%Y-%m-%d-%Hh%M')       # Timestamp
+    # Run report (JSON) and Prometheus textfile : requests, stages, model sizes
+    _RUN_REPORT = Path('./log/') / f'run-report-{ws}.json'
+    _PROMETHEUS_FILE = Path('./log/') / f'leanix-{ws}.prom'
+
+    metrics = RunMetrics(ws)
+    profiler = Profiler(profile, Path('./log/'), ws)
+    status = 'failed'
+    try:
+        convert(ws, leanix_url, leanix_token, sftp_srv, sftp_usr, sftp_pwd, ntfy_channel, when, metrics,
+                profiler, replay=replay, cache_ttl=cache_ttl, cache_max_mb=cache_max_mb,
+                incremental=incremental, columnar=columnar, ntfy_url=ntfy_url,
+                compression=compression, compact_oef=compact_oef, writer_pool=writer_pool,
+                max_workers=max_workers, page_size=page_size)
+        status = 'ok'
+    finally:
+        metrics.finish(status)
+        metrics.write_json(_RUN_REPORT)
+        metrics.write_prometheus(_PROMETHEUS_FILE)
+
+
+@contextmanager
+def stage(metrics, profiler, name):
+    # A stage of the run : timed, and profiled in profiling mode
+    with metrics.stage(name), profiler.stage(name):
+        yield
+
+
+def convert(ws, leanix_url, leanix_token, sftp_srv, sftp_usr, sftp_pwd, ntfy_channel, when, metrics,
+            profiler, replay=False, cache_ttl=0, cache_max_mb=1024, incremental=False, columnar=None,
+            ntfy_url='https://ntfy.sh/', compression=None, compact_oef=False, writer_pool=None,
+            max_workers=4, page_size=100):
+    # See launch_it, each stage is timed in metrics
+    compression = resolve_compression(compression)
     _FULL = False
     _OUTPUT_DIR = Path('./output/')
-    _EXPORT_FILE_LIGHT = f"leanix2archi-{ws}-light.xml"
-    _EXPORT_EXCEL = f"Leanix2excel-{ws}.xlsx"
-    _EXPORT_FILE_FULL = f"leanix2archi-{ws}-full.xml"
-    _WARNING_FILE = f'warnings-{ws}.xlsx'
+    _CHANGELOG = f'changelog-{ws}.txt'
     # Where to retrieve and store the conversion context
     _CHECKSUM_FILENAME = f'last-conversion-{ws}.json'
+    # Where to record LeanIX responses, workspaces have their own cache
+    _CACHE_DIR = Path('./log/') / 'cache' / ws
+    # Where to persist models (incremental extractions, offline processing)
+    _SNAPSHOT_LIGHT = Path('./log/') / f'model-{ws}-light.snapshot'
+    _SNAPSHOT_FULL = Path('./log/') / f'model-{ws}-full.snapshot'
 
     logger.info(f'{when} :  Exporting workspace {ws} ')
-    inform(ntfy_channel, 'Export', 'Started')
-
-    # Connect to LeanIX 
-    graphQL_reader = GraphQLReader(leanix_url, ws, leanix_token, Model())
-    # Populate the model with an extract restricted to Application and Interface
-    graphQL_reader.populate(False)
-    model_light = graphQL_reader.get_model()
+    with metrics.stage('notify'):
+        inform(ntfy_channel, 'Export', 'Started', ntfy_url)
 
+    cache = ResponseCache(_CACHE_DIR, ttl=cache_ttl,
+                          max_bytes=cache_max_mb * 1024 * 1024, replay=replay)
     if _FULL :
-        graphQL_reader = GraphQLReader(leanix_url, ws, leanix_token, Model())
-        # Populate the model with a full extract
-        graphQL_reader.populate(True)
-        model_full = graphQL_reader.get_model()
+        # Populate the model with a full extract, the light model is a subset of it
+        with stage(metrics, profiler, 'extraction'):
+            model_full, watermark = extract_model(ws, leanix_url, leanix_token, True, cache,
+                                                  _SNAPSHOT_FULL, incremental, metrics, max_workers, page_size)
+        with stage(metrics, profiler, 'projection'):
+            model_light = model_full.project(LIGHT_ELEMENT_TYPES, LIGHT_RELATIONSHIP_TYPES,
+                                             LIGHT_DROPPED_TAGS)
+        metrics.record_model('full', model_full)
+    else:
+        # Populate the model with an extract restricted to Application and Interface
+        with stage(metrics, profiler, 'extraction'):
+            model_light, watermark = extract_model(ws, leanix_url, leanix_token, False, cache,
+                                                   _SNAPSHOT_LIGHT, incremental, metrics, max_workers, page_size)
+    metrics.record_model('light', model_light)
 
     logger.info(model_light.get_statistics())
+    logger.info(f'response cache : {cache.hits} hits - {cache.misses} misses')
 
-    checksum_new = check_if_changed(
-        model_light, _CHECKSUM_FILENAME, ws, when, _OUTPUT_DIR / 'changelog.txt')
+    with stage(metrics, profiler, 'checksum'):
+        checksum_new = check_if_changed(
+            model_light, Path('./log/') / _CHECKSUM_FILENAME, ws, when, _OUTPUT_DIR / _CHANGELOG)
+    if replay and not checksum_new:
+        # Replaying is asked to rebuild the outputs : export anyway
+        checksum_new = model_light.get_checksum()
 
     if (checksum_new):    # Something changed in LeanIx or launched in test mode
-        # (2) Create writers
-        archi_writer_light = XmlArchiWriter(model_light)
-        excel_writer_light = ExcelWriter(model_light)
-        if _FULL :
-            archi_writer_full = XmlArchiWriter(model_full)
-
-        # (3) Dump Model in various format
-        # Export in Archi format
-        archi_writer_light.dump(_OUTPUT_DIR / _EXPORT_FILE_LIGHT, getNotes(ws, when))
-        if _FULL :
-            archi_writer_full.dump(_OUTPUT_DIR / _EXPORT_FILE_FULL, getNotes(ws, when))
-        # Export in Excel format
-        excel_writer_light.dump(_OUTPUT_DIR / _EXPORT_EXCEL)
-
-        model_light.dump_warning(_OUTPUT_DIR / _WARNING_FILE)
+        # The OEF notes are dated by the last LeanIX update : the same data gives the same files
+        outputs = dict(output_dir=_OUTPUT_DIR, ws=ws, when=leanix_date(watermark) or when,
+                       compression=compression, compact_oef=compact_oef, columnar=columnar)
+        if writer_pool:
+            # CPU bound : written by another process, from the snapshot saved by the extraction
+            with metrics.stage('writers'):
+                files, stages = writer_pool.submit(
+                    write_snapshot_outputs, _SNAPSHOT_FULL if _FULL else _SNAPSHOT_LIGHT, _FULL,
+                    profiler.enabled, **outputs).result()
+            metrics.merge_stages(stages)
+        else:
+            files = write_outputs(model_light, model_full if _FULL else None, metrics, profiler, **outputs)
         write_last_conversion(
-            Path('./log/') / _CHECKSUM_FILENAME, checksum_new, when, __version__)
+            Path('./log/') / _CHECKSUM_FILENAME, checksum_new, when, __version__,
+            model_light.get_digests())
 
-        cnopts = pysftp.CnOpts()
-        cnopts.hostkeys = None
-        with pysftp.Connection(sftp_srv, username=sftp_usr, password=sftp_pwd, cnopts=cnopts) as sftp:
-            sftp.put(_OUTPUT_DIR / _EXPORT_FILE_LIGHT)
-            sftp.put(_OUTPUT_DIR / _EXPORT_EXCEL)
-            sftp.put(_OUTPUT_DIR / _WARNING_FILE)
+        if sftp_srv:
+            # Concurrent, resumable, unchanged files are not sent again
+            with stage(metrics, profiler, 'sftp'):
+                published = SftpPublisher(sftp_srv, sftp_usr, sftp_pwd).publish(files)
+            logger.info(f'SFTP : {published}')
+        else:
+            logger.info('No SFTP server : files are not uploaded')
 
-        inform(ntfy_channel, 'Export', 'Processed')
+        with metrics.stage('notify'):
+            inform(ntfy_channel, 'Export', 'Processed', ntfy_url)
+
+
+def write_outputs(model_light, model_full, metrics, profiler, output_dir, ws, when, compression=None,
+                  compact_oef=False, columnar=None):
+    """ Dump the models in various format, return the files to publish
+
+    Args:
+        model_full (Model): also exported in Archi format when not None
+        when (str): date of the release notes of the Archi files
+    Files are compressed as they are written, their names get the compression suffix
+    """
+    _EXPORT_FILE_LIGHT = f"leanix2archi-{ws}-light.xml"
+    _EXPORT_EXCEL = f"Leanix2excel-{ws}.xlsx"
+    _EXPORT_FILE_FULL = f"leanix2archi-{ws}-full.xml"
+    _WARNING_FILE = f'warnings-{ws}.xlsx'
+    _EXPORT_COLUMNAR = f'leanix-{ws}'    # prefix of the columnar datasets
+
+    # (2) Create writers
+    archi_writer_light = XmlArchiWriter(model_light)
+    excel_writer_light = ExcelWriter(model_light)
+
+    # (3) Dump Model in various format
+    # Export in Archi format
+    with stage(metrics, profiler, 'oef:light'):
+        oef_light_file = archi_writer_light.dump(output_dir / _EXPORT_FILE_LIGHT, getNotes(ws, when),
+                                                 compression, compact_oef)
+    if model_full :
+        with stage(metrics, profiler, 'oef:full'):
+            XmlArchiWriter(model_full).dump(output_dir / _EXPORT_FILE_FULL, getNotes(ws, when),
+                                            compression, compact_oef)
+    # Export in Excel format
+    with stage(metrics, profiler, 'excel'):
+        excel_file = excel_writer_light.dump(output_dir / _EXPORT_EXCEL, compression)
+
+    with stage(metrics, profiler, 'warnings'):
+        warning_file = model_light.dump_warning(output_dir / _WARNING_FILE, compression)
+    # Export in columnar format (analytics)
+    if columnar:
+        with stage(metrics, profiler, 'columnar'):
+            ColumnarWriter(model_light).dump(output_dir, _EXPORT_COLUMNAR, columnar)
+    return [oef_light_file, excel_file, warning_file]
+
+
+'''
+    Batch mode : several workspaces converted concurrently in this process
+    - the extractions share the HTTP connections and the request budget of the LeanIX host
+    - the files are written by a pool of processes, from the snapshot of each extraction
+'''
+
+
+def init_writer_process(log_queue, level):
+    # Initializer of the writer processes : their records are written by the parent
+    global logger
+    logger = init_queue_log('converter', log_queue, level)
+
+
+def write_snapshot_outputs(snapshot_filename, full, profile, ws, **outputs):
+    """ write_outputs in a writer process, the model is loaded from the snapshot of the extraction
+
+    Return the files to publish and the duration of the stages
+    """
+    model, _ = load_model(snapshot_filename)
+    model_full = None
+    if full:
+        model_full = model
+        model = model_full.project(LIGHT_ELEMENT_TYPES, LIGHT_RELATIONSHIP_TYPES, LIGHT_DROPPED_TAGS)
+    metrics = RunMetrics(ws)
+    files = write_outputs(model, model_full, metrics, Profiler(profile, Path('./log/'), ws), ws=ws,
+                          **outputs)
+    return files, metrics.stages
+
+
+def launch_batch(workspaces, leanix_url, leanix_tokens, sftp_srv, sftp_usr, sftp_pwd, ntfy_channel,
+                 writer_processes=None, **options):
+    """ Launch the extract of several workspaces, concurrently
+
+    Args:
+        workspaces (list): the LeanIx work spaces to extract
+        leanix_tokens (list): the token of each workspace, or a single token for all
+        writer_processes (int): processes writing the files (default : one per CPU, at most one per workspace)
+        options : see launch_it
+    Return the workspaces whose conversion failed, logged
+    """
+    if len(leanix_tokens) == 1:
+        leanix_tokens = leanix_tokens * len(workspaces)
+    if len(leanix_tokens) != len(workspaces):
+        raise ValueError(f'{len(leanix_tokens)} tokens for {len(workspaces)} workspaces')
+    writer_processes = writer_processes or min(len(workspaces), os.cpu_count() or 1)
+    logger.info(f'Exporting {len(workspaces)} workspaces : {workspaces} - {writer_processes} writer processes')
+
+    # spawn : the extraction threads are running, fork would copy their locks
+    context = multiprocessing.get_context('spawn')
+    log_queue = context.Queue()
+    listener = logging.handlers.QueueListener(log_queue, *logger.handlers, respect_handler_level=True)
+    listener.start()
+    failed = []
+    try:
+        with ProcessPoolExecutor(writer_processes, mp_context=context, initializer=init_writer_process,
+                                 initargs=(log_queue, logger.getEffectiveLevel())) as writer_pool, \
+             ThreadPoolExecutor(len(workspaces), thread_name_prefix='workspace') as executor:
+            futures = {ws: executor.submit(launch_it, ws, leanix_url, token, sftp_srv, sftp_usr, sftp_pwd,
+                                           ntfy_channel, writer_pool=writer_pool, **options)
+                       for ws, token in zip(workspaces, leanix_tokens)}
+            for ws, future in futures.items():
+                try:
+                    future.result()
+                except Exception:
+                    logger.exception(f'Export of workspace {ws} failed')
+                    failed.append(ws)
+    finally:
+        listener.stop()
+    return failed
+
+
+def env_flag(name):
+    return os.environ.get(name, '').lower() not in ('', '0', 'false', 'no')
+
+
+def env_number(name, default, type=int):
+    # Unset or empty (docker-compose passes the host variables as they are) : default
+    return type(os.environ.get(name) or default)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Export a LeanIX workspace to Archimate (OEF) and Excel files')
+    parser.add_argument('--replay', action='store_true',
+                        default=env_flag('LEANIX_REPLAY'),
+                        help='rebuild the model from cached LeanIX responses, without network (LEANIX_REPLAY)')
+    parser.add_argument('--cache-ttl', type=int,
+                        default=env_number('LEANIX_CACHE_TTL', 0),
+                        help='reuse cached LeanIX responses younger than this many seconds, 0 only records them (LEANIX_CACHE_TTL)')
+    parser.add_argument('--cache-max-mb', type=int,
+                        default=env_number('LEANIX_CACHE_MAX_MB', 1024),
+                        help='size limit of the response cache in MB (LEANIX_CACHE_MAX_MB)')
+    parser.add_argument('--incremental', action='store_true',
+                        default=env_flag('LEANIX_INCREMENTAL'),
+                        help='only extract the fact sheets updated since the previous run (LEANIX_INCREMENTAL)')
+    parser.add_argument('--columnar', choices=COLUMNAR_FORMATS,
+                        default=os.environ.get('LEANIX_COLUMNAR') or None,
+                        help='also export the model as parquet (needs pyarrow), csv or jsonl datasets (LEANIX_COLUMNAR)')
+    parser.add_argument('--profile', action='store_true',
+                        default=env_flag('LEANIX_PROFILE'),
+                        help='profile each stage : pstats, allocation sites and collapsed stacks in log/ (LEANIX_PROFILE)')
+    parser.add_argument('--compress', choices=COMPRESSIONS,
+                        default=os.environ.get('LEANIX_COMPRESS') or None,
+                        help='compress the OEF and Excel files as they are written, zstd needs zstandard (LEANIX_COMPRESS)')
+    parser.add_argument('--compact-oef', action='store_true',
+                        default=env_flag('LEANIX_COMPACT_OEF'),
+                        help='write the OEF files without indentation nor end of lines (LEANIX_COMPACT_OEF)')
+    parser.add_argument('--max-workers', type=int,
+                        default=env_number('LEANIX_MAX_WORKERS', 4),
+                        help='LeanIX queries run at once for a workspace, 1 : sequential extraction (LEANIX_MAX_WORKERS)')
+    parser.add_argument('--page-size', type=int,
+                        default=env_number('LEANIX_PAGE_SIZE', 100),
+                        help='fact sheets per GraphQL page, bounds the memory held by a query (LEANIX_PAGE_SIZE)')
+    parser.add_argument('--host-concurrency', type=int,
+                        default=env_number('LEANIX_HOST_CONCURRENCY', 8),
+                        help='LeanIX requests in flight at once, all workspaces together, 0 : no limit (LEANIX_HOST_CONCURRENCY)')
+    parser.add_argument('--host-rate', type=float,
+                        default=env_number('LEANIX_HOST_RATE', 0, float),
+                        help='LeanIX requests started per second, all workspaces together, 0 : no limit (LEANIX_HOST_RATE)')
+    parser.add_argument('--writer-processes', type=int,
+                        default=env_number('LEANIX_WRITER_PROCESSES', 0),
+                        help='processes writing the files of several workspaces, 0 : one per CPU (LEANIX_WRITER_PROCESSES)')
+    args = parser.parse_args()
+    if args.replay and args.incremental:
+        # The cache holds the requests of a full extraction, not the updates since a snapshot
+        parser.error('--replay (LEANIX_REPLAY) and --incremental (LEANIX_INCREMENTAL) can not be used together')
+    return args
 
 
 if __name__ == '__main__':
+    args = parse_args()
     logger = init_log('converter', 'converter.log', debug=False)
+    failed = []
     try:
-        launch_it(os.environ['LEANIX_WS'],
-                  os.environ['LEANIX_URL'],
-                  os.environ['LEANIX_TOKEN'],
-                  os.environ['SFTP_SRV'],
-                  os.environ['SFTP_USR'],
-                  os.environ['SFTP_PWD'],
-                  os.environ['NTFY_CHANNEL'])
+        # Comma separated : several workspaces, with their own token or a single token for all
+        workspaces = [ws.strip() for ws in os.environ['LEANIX_WS'].split(',') if ws.strip()]
+        tokens = [token.strip() or None for token in os.environ.get('LEANIX_TOKEN', '').split(',')]
+        # Shared by every workspace : connections and request budget of the LeanIX host
+        get_default_transport().set_host_budget(args.host_concurrency, args.host_rate)
+        options = dict(replay=args.replay,
+                       cache_ttl=args.cache_ttl,
+                       cache_max_mb=args.cache_max_mb,
+                       incremental=args.incremental,
+                       columnar=args.columnar,
+                       ntfy_url=os.environ.get('NTFY_URL') or 'https://ntfy.sh/',
+                       profile=args.profile,
+                       compression=args.compress,
+                       compact_oef=args.compact_oef,
+                       max_workers=args.max_workers,
+                       page_size=args.page_size)
+        if len(workspaces) == 1:
+            launch_it(workspaces[0],
+                      os.environ['LEANIX_URL'],
+                      os.environ.get('LEANIX_TOKEN'),
+                      os.environ.get('SFTP_SRV'),
+                      os.environ.get('SFTP_USR'),
+                      os.environ.get('SFTP_PWD'),
+                      os.environ['NTFY_CHANNEL'],
+                      **options)
+        else:
+            failed = launch_batch(workspaces,
+                                  os.environ['LEANIX_URL'],
+                                  tokens,
+                                  os.environ.get('SFTP_SRV'),
+                                  os.environ.get('SFTP_USR'),
+                                  os.environ.get('SFTP_PWD'),
+                                  os.environ['NTFY_CHANNEL'],
+                                  writer_processes=args.writer_processes,
+                                  **options)
     except:
         logger.exception('')
         sys.exit(1)
+    if failed:
+        logger.error(f'Export failed for workspaces {failed}')
+        sys.exit(1)
@@ -5,9 +5,19 @@
  Purpose :
    Dump LeanIx and convert output in various file format
    - Token management : keep credentials secret
+     Access tokens are cached in memory and on disk (log/), refreshed before
+     they expire or when LeanIX rejects them, and shared by every reader
 '''
 
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
 import requests
+from httpTransport import get_default_transport, base_url
 from customLog import get_default_logger
 
 __author__ = "Serge LASSABE"
@@ -15,17 +25,104 @@ __copyright__ = "Copyright (C) 2023, Serge LASSABE"
 __license__ = "agpl-3.0"
 __version__ = "5.0.1"
 
+REFRESH_MARGIN = 300        # Refresh a token 5 minutes before it expires
+DEFAULT_EXPIRES_IN = 3600   # When LeanIX does not tell
+
 
 def create_credential(base, token):
-    logger = get_default_logger()
-    auth_url = f'https://{base}/services/mtm/v1/oauth2/token'
-
-    resp = requests.post(auth_url,
-                         auth=('apitoken', token),
-                         data={'grant_type': 'client_credentials'})
-    if resp.status_code != requests.codes.ok:
-        logger.error(f'!! create_credential : error for url = {auth_url}')
-        resp.raise_for_status()
-
-    access_token = resp.json()['access_token']
-    return access_token
+    ''' Return a valid access token (shared, cached until it expires) '''
+    return get_credential_manager(base, token).get_token()
+
+
+class CredentialManager():
+    ''' Access token of a LeanIX API token
+
+    - get_token : the cached token, refreshed first when it is about to expire
+    - refresh : a new token, once for all the threads that saw the stale one
+    The disk cache lets successive runs (cron) reuse a token, its name is a
+    digest : the API token itself is never written.
+    '''
+
+    def __init__(self, base, token, cache_dir=None):
+        self.logger = get_default_logger()
+        self.base = base
+        self.token = token
+        self.lock = threading.Lock()
+        self.access_token = None
+        self.expires_at = 0.0
+        self.refresh_at = 0.0
+        self.cache_file = None
+        if cache_dir:
+            digest = hashlib.sha256(f'{base}\n{token}'.encode('utf-8')).hexdigest()[:16]
+            self.cache_file = Path(cache_dir) / f'token-{digest}.json'
+            self.read_cache()
+
+    def get_token(self):
+        with self.lock:
+            if not self.access_token or time.time() >= self.refresh_at:
+                self.fetch()
+            return self.access_token
+
+    def refresh(self, stale_token=None):
+        ''' Called when LeanIX rejected stale_token '''
+        with self.lock:
+            if self.access_token == stale_token or not self.access_token \
+                    or time.time() >= self.refresh_at:
+                self.fetch()
+            # else another thread already refreshed it
+            return self.access_token
+
+    def fetch(self):
+        # Called with the lock held
+        auth_url = f'{base_url(self.base)}/services/mtm/v1/oauth2/token'
+        resp = get_default_transport().post(auth_url,
+                                            auth=('apitoken', self.token),
+                                            data={'grant_type': 'client_credentials'})
+        if resp.status_code != requests.codes.ok:
+            self.logger.error(f'!! create_credential : error for url = {auth_url}')
+            resp.raise_for_status()
+        body = resp.json()
+        expires_in = float(body.get('expires_in') or DEFAULT_EXPIRES_IN)
+        now = time.time()
+        self.access_token = body['access_token']
+        self.expires_at = now + expires_in
+        self.refresh_at = self.expires_at - min(REFRESH_MARGIN, expires_in / 2)
+        self.write_cache()
+
+    def read_cache(self):
+        try:
+            with open(self.cache_file, 'r') as input:
+                data = json.load(input)
+        except (OSError, ValueError):
+            return
+        if time.time() < data.get('refresh_at', 0):
+            self.access_token = data.get('access_token')
+            self.expires_at = data['expires_at']
+            self.refresh_at = data['refresh_at']
+
+    def write_cache(self):
+        if not self.cache_file:
+            return
+        tmp_file = self.cache_file.with_name(self.cache_file.name + '.tmp')
+        try:
+            # Readable by the owner only
+            fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as output:
+                json.dump({'access_token': self.access_token, 'expires_at': self.expires_at,
+                           'refresh_at': self.refresh_at}, output)
+            os.replace(tmp_file, self.cache_file)
+        except OSError as exc:
+            self.logger.debug(f'token not cached in {self.cache_file} : {exc}')
+
+
+_MANAGERS = {}
+_MANAGERS_LOCK = threading.Lock()
+
+
+def get_credential_manager(base, token, cache_dir=Path('./log/')):
+    ''' Return the manager shared by every reader of base with token '''
+    with _MANAGERS_LOCK:
+        manager = _MANAGERS.get((base, token))
+        if manager is None:
+            manager = _MANAGERS[(base, token)] = CredentialManager(base, token, cache_dir)
+        return manager
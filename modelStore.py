@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ Purpose :
+   Dump LeanIx and convert output in various file format
+   - Persist the model between two conversions
+
+ Snapshot file format (version 5) :
+   - header : MAGIC, format version (unsigned short, big endian), marshal version,
+     python major and minor versions (unsigned bytes) : marshal is not stable
+     across python versions, a snapshot is only read by the python that wrote it
+   - then chunks : kind (1 byte), payload length (unsigned int, big endian), payload
+     payload is a zlib compressed marshal dump of a tuple list
+   - chunk kinds :
+       M : metadata (watermark, tag names, type digests, converter version)
+       E : elements (id, type, name, doc, digest, ((tag index, value), ...))
+       R : relationships (id, type, name, doc, source, target, digest, ((tag index, value), ...))
+       O : origins (factSheetId, (element ids), (relationship ids))
+       W : warnings (type, label, context, (origin factSheetIds))
+       Z : end of the snapshot, empty : a snapshot without it is truncated
+   Items are split in chunks of CHUNK_SIZE, so a chunk is the only memory overhead
+   while writing and unknown chunk kinds are skipped while loading.
+   A snapshot written by another version, or that can not be decoded, is ignored :
+   the model is extracted again.
+'''
+
+import marshal
+import os
+import struct
+import sys
+import zlib
+from pathlib import Path
+
+from leanIXConverterModels import Model, Element, Relationship, NO_TAGS
+from customLog import get_default_logger
+
+__author__ = "Serge LASSABE"
+__copyright__ = "Copyright (C) 2023, Serge LASSABE"
+__license__ = "agpl-3.0"
+__version__ = "5.0.1"
+
+MAGIC = b'LX2ASNAP'
+SNAPSHOT_VERSION = 5
+CHUNK_SIZE = 10000
+_HEADER = struct.Struct('>8sHBBB')
+# Errors of a truncated, corrupted or foreign snapshot
+DECODE_ERRORS = (zlib.error, ValueError, EOFError, TypeError, KeyError)
+
+
+def snapshot_header():
+    return _HEADER.pack(MAGIC, SNAPSHOT_VERSION, marshal.version, *sys.version_info[:2])
+_CHUNK = struct.Struct('>cI')
+
+
+def write_chunk(output, kind, records):
+    payload = zlib.compress(marshal.dumps(records), 1)
+    output.write(_CHUNK.pack(kind, len(payload)))
+    output.write(payload)
+
+
+def write_chunks(output, kind, records):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == CHUNK_SIZE:
+            write_chunk(output, kind, chunk)
+            chunk = []
+    if chunk:
+        write_chunk(output, kind, chunk)
+
+
+def iter_chunks(input):
+    while True:
+        header = input.read(_CHUNK.size)
+        if len(header) < _CHUNK.size:
+            return
+        kind, length = _CHUNK.unpack(header)
+        yield kind, input.read(length)
+
+
+def save_model(model, filename, watermark):
+    ''' Persist the model with the watermark of the extraction (most recent LeanIX update) '''
+    filename = Path(filename)
+    tmp_filename = filename.with_name(filename.name + '.tmp')
+    with open(tmp_filename, 'wb') as output:
+        output.write(snapshot_header())
+        write_chunk(output, b'M', [('watermark', watermark),
+                                   ('tag_names', tuple(model.tag_names)),
+                                   ('digests', tuple((group, tuple(digest))
+                                                     for group, digest in model.digests.items())),
+                                   ('version', __version__)])
+        write_chunks(output, b'E', ((elt.leanix_id, elt.leanix_type, elt.leanix_name, elt.doc,
+                                     elt.digest, tuple(elt.tags.items()))
+                                    for elt in model.elt_dict.values()))
+        write_chunks(output, b'R', ((rel.leanix_id, rel.type, rel.leanix_name, rel.doc,
+                                     rel.leanix_source, rel.leanix_target,
+                                     rel.digest, tuple(rel.tags.items()))
+                                    for rel in model.rel_dict.values()))
+        write_chunks(output, b'O', ((origin, tuple(elt_ids), tuple(rel_ids))
+                                    for origin, (elt_ids, rel_ids) in model.origins.items()))
+        write_chunks(output, b'W', ((type, label, ctxt, tuple(origins))
+                                    for type, label, ctxt, origins in model.warnings_collection))
+        write_chunk(output, b'Z', [])
+    os.replace(tmp_filename, filename)
+
+
+def load_model(filename):
+    ''' Return (model, watermark), (None, None) if there is no usable snapshot '''
+    try:
+        input = open(filename, 'rb')
+    except FileNotFoundError:
+        return None, None
+    with input:
+        if input.read(_HEADER.size) != snapshot_header():
+            get_default_logger().warning(f'{filename} was written by another version : not used')
+            return None, None
+        try:
+            return read_model(input)
+        except DECODE_ERRORS as exc:
+            get_default_logger().warning(f'{filename} can not be read ({exc.__class__.__name__} {exc}) : not used')
+            return None, None
+
+
+def read_model(input):
+    model = Model()
+    watermark = None
+    for kind, payload in iter_chunks(input):
+        records = marshal.loads(zlib.decompress(payload))
+        if kind == b'M':
+            metadata = dict(records)
+            watermark = metadata['watermark']
+            with model.lock:
+                for tag in metadata['tag_names']:
+                    model.tag_key(tag)
+            model.digests = {group: list(digest) for group, digest in metadata['digests']}
+        elif kind == b'E':
+            load_elements(model, records)
+        elif kind == b'R':
+            load_relationships(model, records)
+        elif kind == b'O':
+            for origin, elt_ids, rel_ids in records:
+                model.origins[origin] = (list(elt_ids), list(rel_ids))
+        elif kind == b'W':
+            model.warnings_collection.extend([type, label, ctxt, list(origins)]
+                                             for type, label, ctxt, origins in records)
+        elif kind == b'Z':
+            model.reset_malformed_names()
+            return model, watermark
+    raise EOFError('no end of snapshot')
+
+
+def load_elements(model, records):
+    # Items are rebuilt without their constructor : digests are already known
+    index_elt = model.index_elt
+    intern = sys.intern
+    for id, type, name, doc, digest, tags in records:
+        elt = Element.__new__(Element)
+        elt.leanix_id = id = intern(id)
+        elt.leanix_type = intern(type)
+        elt.leanix_name = name
+        elt.doc = doc
+        elt.digest = digest
+        elt.tags = dict(tags) if tags else NO_TAGS
+        index_elt(elt)
+
+
+def load_relationships(model, records):
+    index_rel = model.index_rel
+    intern = sys.intern
+    for id, type, name, doc, src, target, digest, tags in records:
+        rel = Relationship.__new__(Relationship)
+        rel.leanix_id = id = intern(id)
+        rel.type = intern(type)
+        rel.leanix_name = name
+        rel.doc = doc
+        rel.leanix_source = intern(src) if src else src
+        rel.leanix_target = intern(target) if target else target
+        rel.digest = digest
+        rel.tags = dict(tags) if tags else NO_TAGS
+        index_rel(rel)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ Purpose :
+   Dump LeanIx and convert output in various file format
+   - Compress the output files as they are written : gzip, zstd (needs
+     zstandard) or zip, no uncompressed file is written on disk
+'''
+
+import gzip
+import io
+import zipfile
+from contextlib import contextmanager
+from pathlib import Path
+
+from customLog import get_default_logger
+
+try:
+    import zstandard
+except ImportError:     # Optional : gzip and zip only
+    zstandard = None
+
+__author__ = "Serge LASSABE"
+__copyright__ = "Copyright (C) 2023, Serge LASSABE"
+__license__ = "agpl-3.0"
+__version__ = "5.0.1"
+
+COMPRESSIONS = ['gzip', 'zstd', 'zip']
+SUFFIXES = {'gzip': '.gz', 'zstd': '.zst', 'zip': '.zip'}
+GZIP_LEVEL = 6      # zlib default : most of the gain of 9, much faster
+ZSTD_LEVEL = 3
+CHUNK_SIZE = 256 * 1024     # Bytes handed to the compressor at once (text streams)
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+def resolve_compression(compression):
+    ''' The compression used for compression (None : no compression) '''
+    if compression and compression not in COMPRESSIONS:
+        raise ValueError(f'unknown compression {compression}, expected one of {COMPRESSIONS}')
+    if compression == 'zstd' and not zstandard:
+        get_default_logger().warning('zstandard is not installed : output files compressed with gzip')
+        return 'gzip'
+    return compression or None
+
+
+def compressed_name(filename, compression):
+    ''' Name of the file written for filename : report.xml -> report.xml.gz '''
+    filename = Path(filename)
+    if not compression:
+        return filename
+    return filename.with_name(filename.name + SUFFIXES[compression])
+
+
+class NonSeekable(io.RawIOBase):
+    ''' Write only view of a stream, without seek and tell
+
+    zipfile (used by xlsxwriter) then writes sizes after the data instead of
+    seeking back : a compressed stream cannot be rewound.
+    '''
+
+    def __init__(self, output):
+        self.output = output
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.output.write(data)
+
+
+@contextmanager
+def open_compressed(filename, compression, text=False, seekable=True):
+    ''' Open compressed_name(filename, compression) to write
+
+    Args:
+        text (bool): a UTF-8 text stream, binary otherwise
+        seekable (bool): False for writers rewinding when they can (zipfile)
+    A zip archive holds one member, named as filename.
+    '''
+    filename = Path(filename)
+    target = compressed_name(filename, compression)
+    if not compression:
+        with open(target, 'w', encoding='utf-8') if text else open(target, 'wb') as output:
+            yield output
+        return
+    archive = None
+    # No timestamp in the headers : the same content gives the same file (see sftpPublisher)
+    if compression == 'gzip':
+        output = gzip.GzipFile(target, 'wb', compresslevel=GZIP_LEVEL, mtime=0)
+    elif compression == 'zstd':
+        output = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(open(target, 'wb'))
+    else:
+        archive = zipfile.ZipFile(target, 'w')
+        member = zipfile.ZipInfo(filename.name, date_time=ZIP_DATE_TIME)
+        member.compress_type = zipfile.ZIP_DEFLATED
+        output = archive.open(member, 'w', force_zip64=True)
+    try:
+        if text:
+            stream = io.TextIOWrapper(io.BufferedWriter(NonSeekable(output), CHUNK_SIZE), encoding='utf-8')
+        else:
+            stream = output if seekable else NonSeekable(output)
+        yield stream
+        stream.flush()
+    finally:
+        output.close()
+        if archive:
+            archive.close()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ Purpose :
+   Dump LeanIx and convert output in various file format
+   - On-disk cache of LeanIX responses, used to replay an extraction offline
+'''
+
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from customLog import get_default_logger
+
+__author__ = "Serge LASSABE"
+__copyright__ = "Copyright (C) 2023, Serge LASSABE"
+__license__ = "agpl-3.0"
+__version__ = "5.0.1"
+
+
+class ReplayMissError(LookupError):
+    ''' Raised in replay mode when a response was never recorded '''
+
+
+class ResponseCache():
+    ''' Content addressed store of decoded LeanIX responses
+
+    - a response is keyed by endpoint + request payload (query, variables, cursor)
+    - entries older than ttl seconds are ignored, ttl = 0 only records responses
+    - least recently used entries are evicted above max_bytes
+    - in replay mode every entry is used whatever its age, a miss is an error
+    '''
+    SUFFIX = '.json.gz'
+
+    def __init__(self, directory, ttl=0, max_bytes=1024 * 1024 * 1024, replay=False):
+        self.logger = get_default_logger()
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.replay = replay
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.size = sum(entry.stat().st_size for entry in self.entries())
+
+    def entries(self):
+        return self.directory.glob('*' + self.SUFFIX)
+
+    def key(self, endpoint, payload=None):
+        content = json.dumps([endpoint, payload], sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return self.directory / f'{key}{self.SUFFIX}'
+
+    def get(self, key):
+        ''' Return the cached body or None, raise ReplayMissError in replay mode '''
+        body = None
+        if self.replay or self.ttl > 0:
+            path = self.path(key)
+            try:
+                if self.replay or time.time() - path.stat().st_mtime <= self.ttl:
+                    with gzip.open(path, 'rt', encoding='utf-8') as input:
+                        body = json.load(input)
+                    os.utime(path, (time.time(), path.stat().st_mtime))  # LRU clock
+            except FileNotFoundError:
+                body = None
+        with self.lock:
+            if body is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if body is None and self.replay:
+            raise ReplayMissError(f'no recorded response for key {key}')
+        return body
+
+    def put(self, key, body):
+        if self.replay:
+            return
+        path = self.path(key)
+        fd, tmp_name = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=5) as output:
+                output.write(json.dumps(body, separators=(',', ':')).encode('utf-8'))
+            size = os.path.getsize(tmp_name)
+            try:
+                previous = path.stat().st_size
+            except FileNotFoundError:
+                previous = 0
+            os.replace(tmp_name, path)     # Atomic : readers never see partial entries
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+        with self.lock:
+            self.size += size - previous
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        # Remove least recently used entries (access time) down to 90% of max_bytes
+        candidates = []
+        for entry in self.entries():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            candidates.append((stat.st_atime, stat.st_size, entry))
+        candidates.sort(key=lambda candidate: candidate[0])
+        self.size = sum(candidate[1] for candidate in candidates)
+        target = self.max_bytes * 0.9
+        evicted = 0
+        for _, size, entry in candidates:
+            if self.size <= target:
+                break
+            try:
+                entry.unlink()
+            except FileNotFoundError:
+                pass
+            self.size -= size
+            evicted += 1
+        self.logger.info(f'response cache : {evicted} entries evicted, {self.size} bytes kept')
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ Purpose :
+   Dump LeanIx and convert output in various file format
+   - Run instrumentation : LeanIX requests by query kind (latency histogram,
+     bytes, pages, retries, cache hits), wall time of each stage, model sizes
+     Written as a JSON run report and a Prometheus textfile (node_exporter)
+'''
+
+import bisect
+import datetime
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+__author__ = "Serge LASSABE"
+__copyright__ = "Copyright (C) 2023, Serge LASSABE"
+__license__ = "agpl-3.0"
+__version__ = "5.0.1"
+
+# Upper bounds (seconds) of the request latency buckets, +Inf is implicit
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def task_stage(task, args):
+    ''' Stage name of a reader task : manage_element:Application, manage_interfaces... '''
+    return ':'.join([task.__name__] + [arg for arg in args if isinstance(arg, str) and arg])
+
+
+class Histogram():
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)    # Last one : above every bound
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def count(self):
+        return sum(self.counts)
+
+    def cumulative(self):
+        ''' [(upper bound, observations below it)], as Prometheus buckets '''
+        total = 0
+        buckets = []
+        for bound, count in zip(self.bounds + ('+Inf',), self.counts):
+            total += count
+            buckets.append((bound, total))
+        return buckets
+
+
+class RequestStats():
+    __slots__ = ('latency', 'count', 'errors', 'retries', 'bytes', 'pages', 'cache_hits')
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes = 0
+        self.pages = 0
+        self.cache_hits = 0
+
+
+class RunMetrics():
+    ''' Instrumentation of a conversion run, shared by its threads
+
+    - record_request : one LeanIX request (by the transport), retries included
+    - stage : wall time of a pipeline stage (auth, manage_*, writers, SFTP...)
+    - record_model : element, relationship, tag and warning counts of a model
+    '''
+
+    def __init__(self, workspace=''):
+        self.workspace = workspace
+        self.lock = threading.Lock()
+        self.requests = {}      # {query kind: RequestStats}
+        self.stages = {}        # {stage: {'calls': n, 'seconds': s}}
+        self.models = {}        # {model name: sizes}
+        self.started = datetime.datetime.now().isoformat(timespec='seconds')
+        self.start = time.perf_counter()
+        self.duration = None
+        self.status = 'running'
+
+    def kind_stats(self, kind):
+        # Called with the lock held
+        stats = self.requests.get(kind)
+        if stats is None:
+            stats = self.requests[kind] = RequestStats()
+        return stats
+
+    def record_request(self, kind, seconds, size, retries=0, failed=False):
+        with self.lock:
+            stats = self.kind_stats(kind)
+            stats.latency.observe(seconds)
+            stats.count += 1
+            stats.bytes += size
+            stats.retries += retries
+            stats.errors += bool(failed)
+
+    def record_page(self, kind):
+        with self.lock:
+            self.kind_stats(kind).pages += 1
+
+    def record_cache_hit(self, kind):
+        with self.lock:
+            self.kind_stats(kind).cache_hits += 1
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self.lock:
+                stage = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0})
+                stage['calls'] += 1
+                stage['seconds'] += seconds
+
+    def timed(self, name, function):
+        ''' function, timed as the stage name at each call '''
+        def timed_function(*args, **kwargs):
+            with self.stage(name):
+                return function(*args, **kwargs)
+        return timed_function
+
+    def merge_stages(self, stages):
+        ''' Add the stages timed elsewhere (another process) : {stage: {'calls': n, 'seconds': s}} '''
+        with self.lock:
+            for name, other in stages.items():
+                stage = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0})
+                stage['calls'] += other['calls']
+                stage['seconds'] += other['seconds']
+
+    def record_model(self, name, model):
+        warnings = {}
+        for warning in model.warnings_collection:
+            warnings[warning[0]] = warnings.get(warning[0], 0) + 1
+        sizes = {'elements': model.get_elt_counts(),
+                 'relationships': model.get_rel_counts(),
+                 'tags': sum(len(item.tags) for item in model.get_elt_values())
+                         + sum(len(item.tags) for item in model.get_rel_values()),
+                 'tag_names': len(model.tag_names),
+                 'warnings': warnings}
+        with self.lock:
+            self.models[name] = sizes
+
+    def finish(self, status):
+        self.status = status
+        self.duration = time.perf_counter() - self.start
+
+    ## Reports
+    def to_dict(self):
+        with self.lock:
+            return {'workspace': self.workspace,
+                    'started': self.started,
+                    'status': self.status,
+                    'duration_seconds': round(self.duration if self.duration is not None
+                                              else time.perf_counter() - self.start, 3),
+                    'requests': {kind: {'count': stats.count,
+                                        'errors': stats.errors,
+                                        'retries': stats.retries,
+                                        'bytes': stats.bytes,
+                                        'pages': stats.pages,
+                                        'cache_hits': stats.cache_hits,
+                                        'seconds': round(stats.latency.sum, 3),
+                                        'max_seconds': round(stats.latency.max, 3),
+                                        'latency_buckets': {str(bound): count for bound, count
+                                                            in stats.latency.cumulative()}}
+                                 for kind, stats in sorted(self.requests.items())},
+                    'stages': {name: {'calls': stage['calls'], 'seconds': round(stage['seconds'], 3)}
+                               for name, stage in self.stages.items()},
+                    'models': dict(self.models)}
+
+    def write_json(self, filename):
+        with open(filename, 'w') as output:
+            json.dump(self.to_dict(), output, indent=2)
+
+    def prometheus_lines(self):
+        report = self.to_dict()
+        ws = {'workspace': self.workspace}
+
+        def metric(name, type, help):
+            return [f'# HELP leanix_{name} {help}', f'# TYPE leanix_{name} {type}']
+
+        def sample(name, labels, value):
+            return f'leanix_{name}{{{format_labels(labels)}}} {value}'
+
+        lines = metric('run_duration_seconds', 'gauge', 'Duration of the last conversion run')
+        lines.append(sample('run_duration_seconds', ws, report['duration_seconds']))
+        lines += metric('run_success', 'gauge', '1 if the last conversion run succeeded')
+        lines.append(sample('run_success', ws, int(report['status'] == 'ok')))
+        lines += metric('run_timestamp_seconds', 'gauge', 'End of the last conversion run')
+        lines.append(sample('run_timestamp_seconds', ws, round(time.time())))
+
+        lines += metric('request_duration_seconds', 'histogram', 'LeanIX request latency by query kind, retries included')
+        for kind, stats in report['requests'].items():
+            labels = dict(ws, kind=kind)
+            for bound, count in stats['latency_buckets'].items():
+                lines.append(sample('request_duration_seconds_bucket', dict(labels, le=bound), count))
+            lines.append(sample('request_duration_seconds_sum', labels, stats['seconds']))
+            lines.append(sample('request_duration_seconds_count', labels, stats['count']))
+        for name, key, help in (('response_bytes_total', 'bytes', 'LeanIX response bytes by query kind'),
+                                ('pages_total', 'pages', 'Result pages by query kind'),
+                                ('request_retries_total', 'retries', 'Retried LeanIX requests by query kind'),
+                                ('request_errors_total', 'errors', 'Failed LeanIX requests by query kind'),
+                                ('cache_hits_total', 'cache_hits', 'Responses read from the response cache by query kind')):
+            lines += metric(name, 'counter', help)
+            lines += [sample(name, dict(ws, kind=kind), stats[key]) for kind, stats in report['requests'].items()]
+
+        lines += metric('stage_duration_seconds', 'gauge', 'Wall time of a pipeline stage')
+        lines += [sample('stage_duration_seconds', dict(ws, stage=name), stage['seconds'])
+                  for name, stage in report['stages'].items()]
+
+        for name, key, label, help in (('model_elements', 'elements', 'type', 'Elements of the model by type'),
+                                       ('model_relationships', 'relationships', 'type', 'Relationships of the model by type'),
+                                       ('model_warnings', 'warnings', 'warning', 'Conversion warnings by type')):
+            lines += metric(name, 'gauge', help)
+            for model, sizes in report['models'].items():
+                lines += [sample(name, dict(ws, model=model, **{label: value}), count)
+                          for value, count in sizes[key].items()]
+        lines += metric('model_tags', 'gauge', 'Tags set on the items of the model')
+        lines += [sample('model_tags', dict(ws, model=model), sizes['tags'])
+                  for model, sizes in report['models'].items()]
+        return lines
+
+    def write_prometheus(self, filename):
+        # Written aside then renamed : the textfile collector never reads half a file
+        filename = Path(filename)
+        tmp_file = filename.with_name(filename.name + '.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as output:
+            output.write('\n'.join(self.prometheus_lines()) + '\n')
+        os.replace(tmp_file, filename)
+
+
+def format_labels(labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{name}="{escape(value)}"' for name, value in labels.items())
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ Purpose :
+   Dump LeanIx and convert output in various file format
+   - Profiling mode : each stage of a run (extraction, checksum, writers, upload)
+     is profiled, in log/ :
+       profile-<ws>-<stage>.pstats     cProfile statistics (python -m pstats, snakeviz)
+       profile-<ws>-<stage>.alloc.txt  tracemalloc : peak and top allocation sites
+       profile-<ws>-<stage>.collapsed  sampled stacks of every thread, for
+                                       flamegraph.pl or speedscope
+'''
+
+import cProfile
+import os
+import re
+import sys
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+from customLog import get_default_logger
+
+__author__ = "Serge LASSABE"
+__copyright__ = "Copyright (C) 2023, Serge LASSABE"
+__license__ = "agpl-3.0"
+__version__ = "5.0.1"
+
+PROFILE_TOP = 25            # Allocation sites reported per stage
+SAMPLING_INTERVAL = 0.005   # Seconds between two stack samples
+# tracemalloc is process wide : a single stage profiled at once, whatever the workspace
+_PROFILING = threading.Lock()
+
+
+def frame_label(code):
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class StackSampler(threading.Thread):
+    ''' Sample the stacks of every thread : cProfile only sees the thread it runs in
+    (the extraction runs in a thread pool)
+
+    stacks : {collapsed stack, root first: samples}
+    '''
+
+    def __init__(self, interval=SAMPLING_INTERVAL):
+        super().__init__(name='leanix-profiler', daemon=True)
+        self.interval = interval
+        self.stacks = {}
+        self.stopping = threading.Event()
+
+    def run(self):
+        me = threading.get_ident()
+        while not self.stopping.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame:
+                    stack.append(frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, 'thread'))
+                key = ';'.join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+
+    def write(self, filename):
+        with open(filename, 'w', encoding='utf-8') as output:
+            output.writelines(f'{stack} {count}\n' for stack, count in self.stacks.items())
+
+
+class Profiler():
+    ''' Profile the stages of a run, a disabled profiler does nothing
+
+    Stages are profiled one at a time : cProfile and tracemalloc are not nested.
+    Workspaces converted concurrently wait for each other's profiled stages.
+    '''
+
+    def __init__(self, enabled, directory, workspace, top=PROFILE_TOP):
+        self.logger = get_default_logger()
+        self.enabled = enabled
+        self.directory = Path(directory)
+        self.workspace = workspace
+        self.top = top
+
+    def filename(self, stage, suffix):
+        stage = re.sub(r'[^\w.-]+', '-', stage)
+        return self.directory / f'profile-{self.workspace}-{stage}.{suffix}'
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        with _PROFILING:
+            with self.profiled(name):
+                yield
+
+    @contextmanager
+    def profiled(self, name):
+        sampler = StackSampler()
+        profile = cProfile.Profile()
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        sampler.start()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            sampler.stop()
+            peak = tracemalloc.get_traced_memory()[1]
+            after = tracemalloc.take_snapshot()
+            if not tracing:
+                tracemalloc.stop()
+            profile.dump_stats(self.filename(name, 'pstats'))
+            sampler.write(self.filename(name, 'collapsed'))
+            # Without the profiler own allocations (samples, snapshots)
+            filters = [tracemalloc.Filter(False, __file__), tracemalloc.Filter(False, tracemalloc.__file__)]
+            self.write_allocations(name, peak, after.filter_traces(filters).compare_to(
+                before.filter_traces(filters), 'lineno'))
+            self.logger.info(f'profile of {name} written in {self.directory}')
+
+    def write_allocations(self, name, peak, differences):
+        # Memory still allocated at the end of the stage, by allocation site
+        with open(self.filename(name, 'alloc.txt'), 'w', encoding='utf-8') as output:
+            output.write(f'stage {name} : peak traced memory {peak / 2**20:.1f} MiB\n')
+            output.write(f'top {self.top} allocation sites (memory kept at the end of the stage) :\n')
+            for difference in differences[:self.top]:
+                output.write(f'{difference}\n')
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ Purpose :
+   Dump LeanIx and convert output in various file format
+   - Publish the output files on the SFTP server
+     Files are uploaded concurrently over a small pool of sessions, to a
+     temporary name renamed once complete : readers never see half a file.
+     An interrupted upload is resumed, an unchanged file is not sent again
+     (same size and same SHA-256 as the <file>.sha256 sidecar on the server).
+'''
+
+import hashlib
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+import paramiko
+import pysftp
+
+from customLog import get_default_logger
+
+__author__ = "Serge LASSABE"
+__copyright__ = "Copyright (C) 2023, Serge LASSABE"
+__license__ = "agpl-3.0"
+__version__ = "5.0.1"
+
+CHUNK_SIZE = 1024 * 1024    # Bytes read and written at once
+# Errors worth a new session and a new attempt (network, SSH, server side I/O)
+RETRY_ERRORS = (OSError, EOFError, paramiko.SSHException)
+
+
+def file_digest(filename):
+    sha256 = hashlib.sha256()
+    with open(filename, 'rb') as input:
+        while chunk := input.read(CHUNK_SIZE):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class SftpPublisher():
+    ''' Upload files to an SFTP server
+
+    Args:
+        server (str): host, or host:port
+        remote_dir (str): where to upload, the login directory by default
+        sessions (int): files uploaded at once, each over its own session
+        max_retries (int): new attempts for a file, resumed where the previous one stopped
+    '''
+
+    def __init__(self, server, username, password, remote_dir=None, sessions=3, max_retries=3,
+                 backoff_factor=2.0):
+        self.logger = get_default_logger()
+        host, _, port = server.partition(':')
+        self.host = host
+        self.port = int(port or 22)
+        self.username = username
+        self.password = password
+        self.remote_dir = remote_dir
+        self.sessions = sessions
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.cnopts = pysftp.CnOpts()
+        self.cnopts.hostkeys = None
+        self.idle = queue.LifoQueue()   # Sessions ready for the next file
+        self.lock = threading.Lock()
+        self.connections = []
+
+    def connect(self):
+        sftp = pysftp.Connection(self.host, port=self.port, username=self.username,
+                                 password=self.password, cnopts=self.cnopts)
+        if self.remote_dir:
+            sftp.chdir(self.remote_dir)
+        with self.lock:
+            self.connections.append(sftp)
+        return sftp
+
+    @contextmanager
+    def session(self):
+        # An idle session, or a new one. A failing session is dropped.
+        try:
+            sftp = self.idle.get_nowait()
+        except queue.Empty:
+            sftp = self.connect()
+        try:
+            yield sftp
+        except BaseException:
+            self.discard(sftp)
+            raise
+        self.idle.put(sftp)
+
+    def discard(self, sftp):
+        with self.lock:
+            self.connections.remove(sftp)
+        try:
+            sftp.close()
+        except Exception:
+            pass
+
+    def close(self):
+        with self.lock:
+            connections, self.connections = self.connections, []
+        for sftp in connections:
+            sftp.close()
+        self.idle = queue.LifoQueue()
+
+    def publish(self, filenames):
+        ''' Upload the files, return {filename: 'uploaded' or 'unchanged'} '''
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.sessions, len(filenames))),
+                                    thread_name_prefix='sftp') as executor:
+                return dict(zip(filenames, executor.map(self.publish_file, filenames)))
+        finally:
+            self.close()
+
+    def publish_file(self, filename):
+        filename = Path(filename)
+        size = filename.stat().st_size
+        digest = file_digest(filename)
+        attempt = 0
+        while True:
+            try:
+                with self.session() as sftp:
+                    return self.upload(sftp, filename, size, digest)
+            except RETRY_ERRORS as exc:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff_factor * (2 ** attempt)
+                self.logger.warning(
+                    f'{filename.name} : {exc.__class__.__name__} {exc} - retry {attempt + 1}/{self.max_retries} in {delay:.1f}s')
+                attempt += 1
+                time.sleep(delay)
+
+    def upload(self, sftp, filename, size, digest):
+        name = filename.name
+        if self.remote_size(sftp, name) == size and self.remote_digest(sftp, name) == digest:
+            self.logger.info(f'{name} is unchanged on {self.host} : not uploaded')
+            return 'unchanged'
+        # The partial file is named after the content : only the same content is resumed
+        part = f'{name}.{digest[:16]}.part'
+        self.remove_stale_parts(sftp, name, part)
+        offset = self.remote_size(sftp, part) or 0
+        if offset > size:
+            offset = 0
+        if offset:
+            self.logger.info(f'{name} : resuming the upload at {offset}/{size} bytes')
+        with open(filename, 'rb') as local, sftp.open(part, 'ab' if offset else 'wb') as remote:
+            remote.set_pipelined(True)
+            local.seek(offset)
+            while chunk := local.read(CHUNK_SIZE):
+                remote.write(chunk)
+        uploaded = self.remote_size(sftp, part)
+        if uploaded != size:
+            raise OSError(f'{uploaded} bytes uploaded out of {size}')
+        self.rename(sftp, part, name)
+        # Written last : a file is never taken for unchanged with a stale digest
+        with sftp.open(f'{name}.sha256.part', 'w') as remote:
+            remote.write(f'{digest}  {name}\n')
+        self.rename(sftp, f'{name}.sha256.part', f'{name}.sha256')
+        self.logger.info(f'{name} uploaded on {self.host} ({size} bytes)')
+        return 'uploaded'
+
+    def remote_size(self, sftp, name):
+        try:
+            return sftp.stat(name).st_size
+        except FileNotFoundError:
+            return None
+
+    def remote_digest(self, sftp, name):
+        try:
+            with sftp.open(f'{name}.sha256', 'r') as remote:
+                return remote.read().decode('ascii').split()[0]
+        except (FileNotFoundError, UnicodeDecodeError, IndexError):
+            return None
+
+    def remove_stale_parts(self, sftp, name, part):
+        # Partial uploads of a previous content of the file
+        stale = re.compile(rf'{re.escape(name)}\.([0-9a-f]{{16}}|sha256)\.part')
+        for entry in sftp.listdir():
+            if stale.fullmatch(entry) and entry != part:
+                sftp.remove(entry)
+
+    def rename(self, sftp, source, target):
+        # Atomic replacement of target (OpenSSH posix-rename extension)
+        try:
+            sftp.sftp_client.posix_rename(source, target)
+        except OSError:
+            if self.remote_size(sftp, source) is None:
+                raise
+            # Without the extension : not atomic, target is missing a short while
+            self.logger.debug(f'posix-rename not supported : {source} renamed in two steps')
+            if self.remote_size(sftp, target) is not None:
+                sftp.remove(target)
+            sftp.rename(source, target)